@@ -0,0 +1,232 @@
+import asyncio
+import random
+from argparse import ArgumentParser
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from time import perf_counter, time
+from typing import Dict, List, Optional
+from uuid import uuid4
+import httpx
+import orjson
+from sqlalchemy import insert, text
+from db import engine
+from migrations import MARK_HEAVY_AUTHORS, REBUILD_TIMELINES, REBUILD_POST_TAGS
+from models import *
+from validators import get_hash
+
+PASSWORD = "Bench0password"
+TAGS = ["news", "music", "sport", "travel", "food", "tech", "art", "games", "books", "films"]
+CHUNK = 5_000
+
+
+def bench_login(index: int) -> str:
+    return f"bench{index}"
+
+
+async def insert_chunked(connection, table, rows) -> None:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            await connection.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        await connection.execute(insert(table), chunk)
+
+
+async def seed(users: int, friends: int, posts: int, marks: int, truncate: bool, rng: random.Random) -> None:
+    password_hash = get_hash(PASSWORD)
+    now = datetime.now(timezone.utc)
+
+    def user_rows():
+        for index in range(users):
+            yield {"login": bench_login(index), "password": password_hash, "email": f"{bench_login(index)}@bench.local",
+                   "countryCode": "RU", "isPublic": index % 4 != 0, "phone": None, "image": None}
+
+    def friend_rows():
+        for index in range(users):
+            for friend in rng.sample(range(users), min(friends, users)):
+                if friend != index:
+                    yield {"login": bench_login(index), "friend": bench_login(friend),
+                           "addedAt": now - timedelta(seconds=rng.randrange(86_400 * 30))}
+
+    post_marks = []
+
+    def post_rows():
+        for index in range(users):
+            for _ in range(posts):
+                post_id = str(uuid4())
+                voters = rng.sample(range(users), min(marks, users))
+                likes = [rng.random() < 0.7 for _ in voters]
+                post_marks.extend({"post_id": post_id, "login": bench_login(voter), "liked": liked}
+                                  for voter, liked in zip(voters, likes))
+                yield {"id": post_id, "content": f"Benchmark post {post_id}", "author": bench_login(index),
+                       "tags": rng.sample(TAGS, rng.randint(0, 3)),
+                       "createdAt": now - timedelta(seconds=rng.randrange(86_400 * 365)),
+                       "likesCount": sum(likes), "dislikesCount": len(likes) - sum(likes)}
+
+    async with engine.begin() as connection:
+        if truncate:
+            await connection.execute(text("TRUNCATE users, tokens, friends, posts, marks, timelines, heavy_authors, post_tags RESTART IDENTITY"))
+        await insert_chunked(connection, Users.__table__, user_rows())
+        await insert_chunked(connection, Friends.__table__, friend_rows())
+        await insert_chunked(connection, Posts.__table__, post_rows())
+        await insert_chunked(connection, Marks.__table__, post_marks)
+        await connection.execute(text(MARK_HEAVY_AUTHORS))
+        await connection.execute(text(REBUILD_TIMELINES))
+        await connection.execute(text(REBUILD_POST_TAGS))
+    await engine.dispose()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str,
+                      **kwargs) -> Optional[httpx.Response]:
+        started = perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.samples[route].append(perf_counter() - started)
+        if response.status_code >= 500:
+            self.errors[route] += 1
+        return response
+
+    def report(self, duration: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            samples.sort()
+            routes[route] = {"count": len(samples), "errors": self.errors[route],
+                             "throughput": len(samples) / duration,
+                             "mean": sum(samples) / len(samples),
+                             "p50": percentile(samples, 50), "p95": percentile(samples, 95),
+                             "p99": percentile(samples, 99)}
+        total = sum(route["count"] for route in routes.values())
+        return {"duration": duration, "requests": total, "throughput": total / duration, "routes": routes}
+
+
+def percentile(samples: List[float], rank: int) -> float:
+    return samples[min(len(samples) - 1, max(0, round(rank / 100 * len(samples)) - 1))]
+
+
+async def sign_in(recorder: Recorder, client: httpx.AsyncClient, login: str) -> Optional[str]:
+    response = await recorder.request(client, "POST /api/auth/sign-in", "POST", "/api/auth/sign-in",
+                                      json={"login": login, "password": PASSWORD})
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()["token"]
+
+
+async def worker(recorder: Recorder, client: httpx.AsyncClient, users: int, hot_post: str, deadline: float,
+                 weights: Dict[str, int], rng: random.Random) -> None:
+    token = await sign_in(recorder, client, bench_login(rng.randrange(users)))
+    headers = {"Authorization": f"Bearer {token}"}
+    scenarios, scenario_weights = list(weights), list(weights.values())
+
+    while time() < deadline:
+        scenario = rng.choices(scenarios, scenario_weights)[0]
+        login = bench_login(rng.randrange(users))
+
+        if scenario == "register":
+            name = f"reg{uuid4().hex[:20]}"
+            await recorder.request(client, "POST /api/auth/register", "POST", "/api/auth/register",
+                                   json={"login": name, "password": PASSWORD, "email": f"{name}@bench.local",
+                                         "countryCode": "RU", "isPublic": True})
+        elif scenario == "sign_in":
+            token = await sign_in(recorder, client, login) or token
+            headers = {"Authorization": f"Bearer {token}"}
+        elif scenario == "profile":
+            await recorder.request(client, "GET /api/profiles/{login}", "GET", f"/api/profiles/{login}",
+                                   headers=headers)
+            await recorder.request(client, "GET /api/me/profile", "GET", "/api/me/profile", headers=headers)
+        elif scenario == "feed":
+            params = {"limit": 10}
+            for _ in range(3):
+                response = await recorder.request(client, "GET /api/posts/feed/{login}", "GET",
+                                                  f"/api/posts/feed/{login}", headers=headers, params=params)
+                if response is None or "X-Next-Cursor" not in response.headers:
+                    break
+                params = {"limit": 10, "cursor": response.headers["X-Next-Cursor"]}
+        elif scenario == "timeline":
+            params = {"limit": 10}
+            for _ in range(3):
+                response = await recorder.request(client, "GET /api/posts/timeline", "GET", "/api/posts/timeline",
+                                                  headers=headers, params=params)
+                if response is None or "X-Next-Cursor" not in response.headers:
+                    break
+                params = {"limit": 10, "cursor": response.headers["X-Next-Cursor"]}
+        elif scenario == "like_storm":
+            reaction = rng.choice(["like", "dislike"])
+            await recorder.request(client, f"POST /api/posts/{{postId}}/{reaction}", "POST",
+                                   f"/api/posts/{hot_post}/{reaction}", headers=headers)
+
+
+async def find_hot_post(client: httpx.AsyncClient) -> str:
+    recorder = Recorder()
+    token = await sign_in(recorder, client, bench_login(1))
+    response = await client.get(f"/api/posts/feed/{bench_login(1)}", params={"limit": 1},
+                                headers={"Authorization": f"Bearer {token}"})
+    return response.json()[0]["id"]
+
+
+async def run(url: Optional[str], users: int, concurrency: int, duration: float, weights: Dict[str, int],
+              rng: random.Random) -> dict:
+    if url is None:
+        from main import api
+        transport = httpx.ASGITransport(app=api)
+        lifespan = api.router.lifespan_context(api)
+        await lifespan.__aenter__()
+        url = "http://bench"
+    else:
+        transport, lifespan = None, None
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=url, transport=transport, limits=limits, timeout=30) as client:
+            hot_post = await find_hot_post(client)
+            recorder = Recorder()
+            started = time()
+            await asyncio.gather(*[worker(recorder, client, users, hot_post, started + duration, weights,
+                                         random.Random(rng.random())) for _ in range(concurrency)])
+            return recorder.report(time() - started)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Seed a benchmark dataset and drive mixed traffic against the API")
+    parser.add_argument("command", choices=["seed", "run"])
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--friends", type=int, default=20, help="friends added by every user")
+    parser.add_argument("--posts", type=int, default=10, help="posts written by every user")
+    parser.add_argument("--marks", type=int, default=5, help="reactions on every post")
+    parser.add_argument("--truncate", action="store_true", help="empty the tables before seeding")
+    parser.add_argument("--url", default=None, help="server to load, the app runs in-process when omitted")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", default="register=1,sign_in=2,profile=25,feed=30,timeline=20,like_storm=22",
+                        help="scenario weights")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for reproducible runs")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    if args.command == "seed":
+        asyncio.run(seed(args.users, args.friends, args.posts, args.marks, args.truncate, rng))
+    else:
+        weights = {name: int(weight) for name, weight in (item.split("=") for item in args.mix.split(","))}
+        report = asyncio.run(run(args.url, args.users, args.concurrency, args.duration, weights, rng))
+        report["config"] = vars(args)
+        with open(args.output, "wb") as output:
+            output.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        for route, result in report["routes"].items():
+            print(f"{route:<40} {result['count']:>8} {result['throughput']:>9.1f}/s "
+                  f"p50={result['p50'] * 1000:.1f}ms p95={result['p95'] * 1000:.1f}ms p99={result['p99'] * 1000:.1f}ms")
+        failed = [route for route, result in report["routes"].items() if result["errors"]]
+        if failed:
+            raise SystemExit(f"server errors on: {', '.join(failed)}")
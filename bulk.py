@@ -0,0 +1,87 @@
+import asyncio
+import csv
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import asyncpg
+from migrations import REBUILD_POST_TAGS, MARK_HEAVY_AUTHORS, REBUILD_TIMELINES
+from settings import get_settings
+from validators import get_hash
+
+settings = get_settings()
+dsn = f"postgresql://{settings.POSTGRES_USERNAME}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DATABASE}"
+
+COLUMNS = {
+    "users": ["login", "password", "email", "countryCode", "isPublic", "phone", "image"],
+    "friends": ["login", "friend", "addedAt"],
+    "posts": ["id", "content", "author", "tags", "createdAt", "likesCount", "dislikesCount"],
+    "marks": ["post_id", "login", "liked"],
+}
+
+
+def parse_user(row: dict, password: str) -> tuple:
+    return (row["login"], password, row["email"], row["countryCode"], row["isPublic"].lower() in ("t", "true", "1"),
+            row.get("phone") or None, row.get("image") or None)
+
+
+async def import_users(connection, path: str, chunk_size: int, workers: int) -> int:
+    total = 0
+    loop = asyncio.get_running_loop()
+    with open(path, newline="", encoding="utf-8") as source, ProcessPoolExecutor(workers) as executor:
+        reader = csv.DictReader(source)
+        while chunk := list(islice(reader, chunk_size)):
+            passwords = await asyncio.gather(*[loop.run_in_executor(executor, get_hash, row["password"])
+                                               for row in chunk])
+            records = [parse_user(row, password) for row, password in zip(chunk, passwords)]
+            await connection.copy_records_to_table("users", records=records, columns=COLUMNS["users"])
+            total += len(records)
+            print(f"users: {total} rows")
+    return total
+
+
+async def import_table(connection, table: str, path: str, hashed: bool, chunk_size: int, workers: int) -> None:
+    if table == "users" and not hashed:
+        await import_users(connection, path, chunk_size, workers)
+        return
+
+    with open(path, "rb") as source:
+        status = await connection.copy_to_table(table, source=source, columns=COLUMNS[table],
+                                                format="csv", header=True)
+    print(f"{table}: {status}")
+
+    if table == "posts":
+        print(f"post_tags: {await connection.execute(REBUILD_POST_TAGS)}")
+    if table in ("posts", "friends"):
+        print(f"heavy_authors: {await connection.execute(MARK_HEAVY_AUTHORS)}")
+        print(f"timelines: {await connection.execute(REBUILD_TIMELINES)}")
+
+
+async def export_table(connection, table: str, path: str) -> None:
+    with open(path, "wb") as output:
+        status = await connection.copy_from_table(table, output=output, columns=COLUMNS[table],
+                                                  format="csv", header=True)
+    print(f"{table}: {status}")
+
+
+async def main(args) -> None:
+    connection = await asyncpg.connect(dsn)
+    try:
+        if args.command == "import":
+            async with connection.transaction():
+                await import_table(connection, args.table, args.path, args.hashed, args.chunk_size, args.workers)
+        else:
+            await export_table(connection, args.table, args.path)
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Bulk load or dump tables with COPY")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("table", choices=list(COLUMNS))
+    parser.add_argument("path", help="CSV file with a header row")
+    parser.add_argument("--hashed", action="store_true",
+                        help="users.password already holds get_hash values, e.g. from an export")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="users hashed and copied per batch")
+    parser.add_argument("--workers", type=int, default=None, help="processes used to hash passwords")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from hashlib import sha1
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import orjson
+from crud import CRUD
+from db import session_maker
+from schemas import Country
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+db = CRUD()
+
+
+class CountriesCatalogue:
+    def __init__(self):
+        self.countries: List[Country] = []
+        self.by_alpha2: Dict[str, Country] = {}
+        self.by_region: Dict[Optional[str], List[Country]] = {}
+        self._responses: Dict[FrozenSet[str], Tuple[bytes, str]] = {}
+
+    async def load(self, session) -> None:
+        array_countries = (await db.get_countries(session)).all()
+        self.countries = [Country(name=country.name, alpha2=country.alpha2,
+                                  alpha3=country.alpha3, region=country.region) for country in array_countries]
+        self.by_alpha2 = {}
+        self.by_region = {}
+        for country in self.countries:
+            self.by_alpha2.setdefault(country.alpha2, country)
+            self.by_region.setdefault(country.region, []).append(country)
+        self._responses = {}
+
+    def get(self, alpha2: str) -> Optional[Country]:
+        return self.by_alpha2.get(alpha2)
+
+    def response(self, regions: FrozenSet[str]) -> Tuple[bytes, str]:
+        cached = self._responses.get(regions)
+        if cached is None:
+            if regions:
+                array_countries = [country for country in self.countries if country.region in regions]
+            else:
+                array_countries = self.countries
+            body = orjson.dumps([country.model_dump() for country in array_countries])
+            cached = self._responses[regions] = (body, f'"{sha1(body).hexdigest()}"')
+        return cached
+
+
+catalogue = CountriesCatalogue()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison of RFC 9110, and "*" matches any current representation
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+async def refresh_catalogue() -> None:
+    while True:
+        await asyncio.sleep(settings.CATALOGUE_REFRESH_INTERVAL)
+        try:
+            async with session_maker() as session:
+                await catalogue.load(session)
+        except Exception:
+            logger.exception("Failed to refresh the countries catalogue")
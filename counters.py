@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+from crud import CRUD
+from db import session_maker
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+db = CRUD()
+
+
+class ReactionCounters:
+    def __init__(self):
+        self._pending: Dict[str, List[int]] = {}
+        self._flushing: Dict[str, List[int]] = {}
+
+    def add(self, postId: str, likes: int, dislikes: int) -> None:
+        counts = self._pending.setdefault(postId, [0, 0])
+        counts[0] += likes
+        counts[1] += dislikes
+
+    def merge(self, postId: str, likesCount: int, dislikesCount: int) -> Tuple[int, int]:
+        for deltas in (self._pending, self._flushing):
+            counts = deltas.get(postId)
+            if counts is not None:
+                likesCount += counts[0]
+                dislikesCount += counts[1]
+        return likesCount, dislikesCount
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        flushing = self._flushing = self._pending
+        self._pending = {}
+        try:
+            async with session_maker() as session:
+                await db.apply_reaction_deltas(session, flushing)
+                # committed rows already hold these deltas, stop merging them before the session closes
+                self._flushing = {}
+        except Exception:
+            if self._flushing:
+                self._flushing = {}
+                for postId, (likes, dislikes) in flushing.items():
+                    self.add(postId, likes, dislikes)
+            raise
+
+
+reaction_counters = ReactionCounters()
+
+
+async def flush_reactions() -> None:
+    try:
+        while True:
+            await asyncio.sleep(settings.REACTION_FLUSH_INTERVAL)
+            try:
+                await reaction_counters.flush()
+            except Exception:
+                logger.exception("Failed to flush reaction counters")
+    finally:
+        await reaction_counters.flush()
@@ -1,89 +1,176 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from validators import get_hash
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, update, exists, or_, tuple_, literal_column, bindparam, func, union, true
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
 from models import *
 from schemas import *
+from validators import normalize_tag
+
+
+def visible_to(viewer: str, author):
+    # aliased so the EXISTS never auto-correlates to a Friends/Users join in the enclosing query
+    users, friends = aliased(Users), aliased(Friends)
+    return or_(author == viewer,
+               exists().where(users.login == author, users.isPublic),
+               exists().where(friends.login == author, friends.friend == viewer))
 
 
 class CRUD:
-    def get_countries(self, session: Session):
+    async def get_countries(self, session: AsyncSession):
         sql_query = select(Countries).order_by(Countries.alpha2)
-        result = session.execute(sql_query)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_country_by_alpha2(self, session: Session, alpha2: str):
-        sql_query = select(Countries).filter(Countries.alpha2 == alpha2)
-        result = session.execute(sql_query)
+    async def get_user_by_login(self, session: AsyncSession, login: str):
+        sql_query = select(Users).filter(Users.login == login)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_users(self, session: Session):
-        sql_query = select(Users).order_by(Users.id)
-        result = session.execute(sql_query)
+    async def get_user_by_phone(self, session: AsyncSession, phone: str):
+        sql_query = select(Users).filter(Users.phone == phone)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_user_by_login(self, session: Session, login: str):
-        sql_query = select(Users).filter(Users.login == login)
-        result = session.execute(sql_query)
+    async def get_user_by_credentials(self, session: AsyncSession, login: str, email: str,
+                                      phone: Optional[str]):
+        conditions = [Users.login == login, Users.email == email]
+        if phone is not None:
+            conditions.append(Users.phone == phone)
+        sql_query = select(Users.id).filter(or_(*conditions)).limit(1)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_user_by_phone(self, session: Session, phone: str):
-        sql_query = select(Users).filter(Users.phone == phone)
-        result = session.execute(sql_query)
+    async def get_token_by_token(self, session: AsyncSession, token: str):
+        sql_query = select(Tokens).filter(Tokens.token == token).execution_options(use_primary=True)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_user_by_email(self, session: Session, email: str):
-        sql_query = select(Users).filter(Users.email == email)
-        result = session.execute(sql_query)
+    async def get_last_write(self, session: AsyncSession, login: str) -> Optional[float]:
+        sql_query = (select(RecentWrites.written_at).filter(RecentWrites.login == login)
+                     .execution_options(use_primary=True))
+        result = await session.execute(sql_query)
+
+        return result.scalar_one_or_none()
+
+    async def get_friend_by_login(self, session: AsyncSession, login: str, friend: str):
+        sql_query = (select(Friends).filter(Friends.login == login, Friends.friend == friend)
+                     .execution_options(use_primary=True))
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_token_by_token(self, session: Session, token: str):
-        sql_query = select(Tokens).filter(Tokens.token == token)
-        result = session.execute(sql_query)
+    async def get_post_by_id(self, session: AsyncSession, postId: str):
+        sql_query = select(Posts).filter(Posts.id == postId)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_friends_by_login(self, session: Session, login: str):
-        sql_query = select(Friends).filter(Friends.login == login)
-        result = session.execute(sql_query)
+    async def get_posts_by_ids(self, session: AsyncSession, ids: List[str]):
+        sql_query = select(Posts).filter(Posts.id.in_(ids))
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_friend_by_login(self, session: Session, login: str, friend: str):
-        sql_query = select(Friends).filter(Friends.login.like(login), Friends.friend.like(friend))
-        result = session.execute(sql_query)
+    async def get_users_by_logins(self, session: AsyncSession, logins: List[str]):
+        sql_query = select(Users).filter(Users.login.in_(logins))
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_post_by_id(self, session: Session, postId: str):
-        sql_query = select(Posts).filter(Posts.id == postId)
-        result = session.execute(sql_query)
+    async def get_visible_authors(self, session: AsyncSession, viewer: str, authors: List[str]):
+        sql_query = select(Users.login).filter(Users.login.in_(authors), visible_to(viewer, Users.login))
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_posts_by_login(self, session: Session, login: str):
+    async def is_friend(self, session: AsyncSession, login: str, friend: str) -> bool:
+        sql_query = select(exists().where(Friends.login == login, Friends.friend == friend))
+        result = await session.execute(sql_query)
+
+        return result.scalar()
+
+    async def get_friends_page(self, session: AsyncSession, login: str, limit: int, offset: int,
+                               cursor: Optional[List] = None):
+        sql_query = select(Friends).filter(Friends.login == login)
+        if cursor is not None:
+            sql_query = sql_query.filter(tuple_(Friends.addedAt, Friends.id) < tuple_(*cursor))
+        sql_query = sql_query.order_by(Friends.addedAt.desc(), Friends.id.desc()).offset(offset).limit(limit)
+        result = await session.execute(sql_query)
+
+        return result.scalars()
+
+    async def get_posts_page(self, session: AsyncSession, login: str, limit: int, offset: int,
+                             cursor: Optional[List] = None):
         sql_query = select(Posts).filter(Posts.author == login)
-        result = session.execute(sql_query)
+        if cursor is not None:
+            sql_query = sql_query.filter(tuple_(Posts.createdAt, Posts.id) < tuple_(*cursor))
+        sql_query = sql_query.order_by(Posts.createdAt.desc(), Posts.id.desc()).offset(offset).limit(limit)
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def get_mark_for_post(self, session: Session, postId: str, login: str):
-        sql_query = select(Marks).filter(Marks.post_id.like(postId), Marks.login.like(login))
-        result = session.execute(sql_query)
+    async def get_timeline_page(self, session: AsyncSession, login: str, limit: int, offset: int,
+                                cursor: Optional[List] = None):
+        # fan-out, unfriending and privacy changes keep timelines visible, so this is a plain index range scan
+        pushed = (select(Timelines.post_id.label("id"), Timelines.createdAt.label("createdAt"))
+                  .filter(Timelines.owner == login))
+        followed = (select(HeavyAuthors.login)
+                    .filter(exists().where(Friends.login == login, Friends.friend == HeavyAuthors.login)))
+        pulled = (select(Posts.id.label("id"), Posts.createdAt.label("createdAt"))
+                  .filter(Posts.author.in_(followed.scalar_subquery()), visible_to(login, Posts.author)))
+        if cursor is not None:
+            pushed = pushed.filter(tuple_(Timelines.createdAt, Timelines.post_id) < tuple_(*cursor))
+            pulled = pulled.filter(tuple_(Posts.createdAt, Posts.id) < tuple_(*cursor))
+        pushed = pushed.order_by(Timelines.createdAt.desc(), Timelines.post_id.desc()).limit(offset + limit)
+        pulled = pulled.order_by(Posts.createdAt.desc(), Posts.id.desc()).limit(offset + limit)
+
+        branches = [branch.subquery() for branch in (pushed, pulled)]
+        entries = union(*[select(branch.c.id, branch.c.createdAt) for branch in branches]).subquery()
+        sql_query = (select(Posts).join(entries, entries.c.id == Posts.id)
+                     .order_by(entries.c.createdAt.desc(), entries.c.id.desc()).offset(offset).limit(limit))
+        result = await session.execute(sql_query)
 
         return result.scalars()
 
-    def update_user_by_login(self, session: Session, login: str,
-                             user_data: UpdateProfile):
-        sql_query = select(Users).filter(Users.login == login)
-        result = session.execute(sql_query)
+    async def get_tag_page(self, session: AsyncSession, login: str, tag: str, limit: int, offset: int,
+                           cursor: Optional[List] = None):
+        sql_query = (select(Posts).join(PostTags, PostTags.post_id == Posts.id)
+                     .filter(PostTags.tag == normalize_tag(tag), visible_to(login, PostTags.author)))
+        if cursor is not None:
+            sql_query = sql_query.filter(tuple_(PostTags.createdAt, PostTags.post_id) < tuple_(*cursor))
+        sql_query = (sql_query.order_by(PostTags.createdAt.desc(), PostTags.post_id.desc())
+                     .offset(offset).limit(limit))
+        result = await session.execute(sql_query)
+
+        return result.scalars()
+
+    async def search_posts(self, session: AsyncSession, login: str, query: str, limit: int, offset: int,
+                           cursor: Optional[List] = None):
+        tsquery = func.websearch_to_tsquery(literal_column("'simple'::regconfig"), query)
+        rank = func.ts_rank(Posts.search_vector, tsquery)
+        sql_query = (select(Posts, rank.label("rank"))
+                     .filter(Posts.search_vector.bool_op("@@")(tsquery), visible_to(login, Posts.author)))
+        if cursor is not None:
+            sql_query = sql_query.filter(tuple_(rank, Posts.createdAt, Posts.id) < tuple_(*cursor))
+        sql_query = (sql_query.order_by(rank.desc(), Posts.createdAt.desc(), Posts.id.desc())
+                     .offset(offset).limit(limit))
+        result = await session.execute(sql_query)
+
+        return result
+
+    async def update_user_by_login(self, session: AsyncSession, login: str,
+                                   user_data: UpdateProfile, backfill: int):
+        sql_query = select(Users).filter(Users.login == login).execution_options(use_primary=True)
+        result = await session.execute(sql_query)
         user = result.scalars().one()
 
+        privacy_changed = user_data.isPublic is not None and user_data.isPublic != user.isPublic
+
         if user_data.countryCode is not None:
             user.countryCode = user_data.countryCode
         if user_data.isPublic is not None:
@@ -96,83 +183,162 @@ class CRUD:
             user.phone = user_data.phone
         if user.phone == "":
             user.phone = None
-        session.commit()
-
-    def update_password_by_login(self, session: Session, login: str,
-                                 newPassword: str):
-        sql_query = select(Users).filter(Users.login == login)
-        result = session.execute(sql_query)
-        user = result.scalars().one()
-        user.password = get_hash(newPassword)
-        session.commit()
-
-    def increment_like(self, session: Session, postId: str):
-        sql_query = select(Posts).filter(Posts.id == postId)
-        result = session.execute(sql_query)
-        post = result.scalars().one()
-        post.likesCount += 1
-        session.commit()
-
-    def decrement_like(self, session: Session, postId: str):
-        sql_query = select(Posts).filter(Posts.id == postId)
-        result = session.execute(sql_query)
-        post = result.scalars().one()
-        post.likesCount -= 1
-        session.commit()
-
-    def increment_dislike(self, session: Session, postId: str):
-        sql_query = select(Posts).filter(Posts.id == postId)
-        result = session.execute(sql_query)
-        post = result.scalars().one()
-        post.dislikesCount += 1
-        session.commit()
-
-    def decrement_dislike(self, session: Session, postId: str):
-        sql_query = select(Posts).filter(Posts.id == postId)
-        result = session.execute(sql_query)
-        post = result.scalars().one()
-        post.dislikesCount -= 1
-        session.commit()
-
-    def change_mark(self, session: Session, postId: str, login: str):
-        sql_query = select(Marks).filter(Marks.post_id.like(postId), Marks.login.like(login))
-        result = session.execute(sql_query)
-        mark = result.scalars().one()
-        mark.liked = not mark.liked
-        session.commit()
-
-    def post_create_user(self, session: Session, user_data: Users):
+        if privacy_changed:
+            await session.flush()
+            await self.sync_author_timelines(session, login, user.isPublic, backfill)
+        await session.commit()
+
+    async def update_password_by_login(self, session: AsyncSession, login: str,
+                                       password_hash: str):
+        sql_query = update(Users).filter(Users.login == login).values(password=password_hash)
+        await session.execute(sql_query)
+        await session.commit()
+
+    async def upsert_mark(self, session: AsyncSession, postId: str, login: str,
+                          liked: bool) -> Optional[Tuple[int, int]]:
+        sql_query = (insert(Marks).values(post_id=postId, login=login, liked=liked)
+                     .on_conflict_do_update(index_elements=[Marks.post_id, Marks.login], set_={"liked": liked},
+                                            where=Marks.liked != liked)
+                     .returning(literal_column("xmax = 0")))
+        result = await session.execute(sql_query)
+        inserted = result.scalar_one_or_none()
+
+        if inserted is None:
+            return None
+
+        delta = 1 if liked else -1
+        if inserted:
+            return max(delta, 0), max(-delta, 0)
+        return delta, -delta
+
+    async def update_reaction_counts(self, session: AsyncSession, postId: str, likes: int, dislikes: int):
+        sql_query = (update(Posts).filter(Posts.id == postId)
+                     .values(likesCount=Posts.likesCount + likes, dislikesCount=Posts.dislikesCount + dislikes)
+                     .returning(Posts.likesCount, Posts.dislikesCount)
+                     .execution_options(synchronize_session=False))
+        result = await session.execute(sql_query)
+
+        return result.one()
+
+    async def react(self, session: AsyncSession, postId: str, login: str, liked: bool):
+        delta = await self.upsert_mark(session, postId, login, liked)
+        counts = await self.update_reaction_counts(session, postId, *delta) if delta is not None else None
+        await session.commit()
+
+        return counts
+
+    async def react_deferred(self, session: AsyncSession, postId: str, login: str,
+                             liked: bool) -> Optional[Tuple[int, int]]:
+        delta = await self.upsert_mark(session, postId, login, liked)
+        await session.commit()
+
+        return delta
+
+    async def apply_reaction_deltas(self, session: AsyncSession, deltas: Dict[str, Tuple[int, int]]):
+        posts = Posts.__table__
+        sql_query = (update(posts).where(posts.c.id == bindparam("post_id"))
+                     .values(likesCount=posts.c.likesCount + bindparam("likes"),
+                             dislikesCount=posts.c.dislikesCount + bindparam("dislikes")))
+        await session.execute(sql_query, [{"post_id": postId, "likes": likes, "dislikes": dislikes}
+                                          for postId, (likes, dislikes) in sorted(deltas.items())])
+        await session.commit()
+
+    async def post_create_user(self, session: AsyncSession, user_data: Users):
         session.add(user_data)
-        session.commit()
+        await session.commit()
 
-    def post_create_token(self, session: Session, token_data: Tokens):
+    async def post_create_token(self, session: AsyncSession, token_data: Tokens):
         session.add(token_data)
-        session.commit()
+        await session.commit()
 
-    def post_create_friend(self, session: Session, friend_data: Friends):
+    async def post_create_friend(self, session: AsyncSession, friend_data: Friends, backfill: int):
         session.add(friend_data)
-        session.commit()
+        await session.flush()
+        await self.backfill_timeline(session, friend_data.login, friend_data.friend, backfill)
+        # a private author's followers can see its posts once it adds them
+        await self.backfill_timeline(session, friend_data.friend, friend_data.login, backfill)
+        await session.commit()
 
-    def post_create_post(self, session: Session, post_data: Posts):
+    async def post_create_post(self, session: AsyncSession, post_data: Posts, fanout_limit: int):
         session.add(post_data)
-        session.commit()
-
-    def post_create_mark(self, session: Session, mark_data: Marks):
-        session.add(mark_data)
-        session.commit()
-
-    def delete_token(self, session: Session, token_data: Tokens):
-        session.delete(token_data)
-        session.commit()
-
-    def delete_tokens_by_login(self, session: Session, login: str):
+        session.add_all([PostTags(tag=tag, post_id=post_data.id, author=post_data.author,
+                                  createdAt=post_data.createdAt)
+                         for tag in dict.fromkeys(map(normalize_tag, post_data.tags)) if tag])
+        await self.fan_out_post(session, post_data, fanout_limit)
+        await session.commit()
+
+    async def fan_out_post(self, session: AsyncSession, post_data: Posts, limit: int) -> bool:
+        followers = select(Friends.login).filter(Friends.friend == post_data.author).limit(limit + 1).subquery()
+        result = await session.execute(select(func.count()).select_from(followers))
+
+        if result.scalar() > limit:
+            await session.execute(insert(HeavyAuthors).values(login=post_data.author).on_conflict_do_nothing())
+            return False
+
+        entries = (select(Friends.login, Posts.id, Posts.author, Posts.createdAt)
+                   .join(Posts, Posts.author == Friends.friend)
+                   .filter(Posts.id == post_data.id, visible_to(Friends.login, Posts.author)))
+        await session.execute(insert(Timelines).from_select(["owner", "post_id", "author", "createdAt"], entries)
+                              .on_conflict_do_nothing())
+        return True
+
+    async def delete_tokens_by_login(self, session: AsyncSession, login: str):
         sql_query = select(Tokens).filter(Tokens.login == login)
-        result = session.execute(sql_query)
+        result = await session.execute(sql_query)
         tokens = result.scalars().all()
         for token in tokens:
-            session.delete(token)
-        session.commit()
-
-    def delete_friend(self, session: Session, friend_data: Friends):
-        session.delete(friend_data)
-        session.commit()
+            await session.delete(token)
+        await session.commit()
+
+    async def delete_friend(self, session: AsyncSession, friend_data: Friends):
+        await session.delete(friend_data)
+        await session.execute(delete(Timelines).filter(Timelines.owner == friend_data.login,
+                                                       Timelines.author == friend_data.friend))
+        await session.execute(delete(Timelines)
+                              .filter(Timelines.owner == friend_data.friend, Timelines.author == friend_data.login,
+                                      ~exists().where(Users.login == friend_data.login, Users.isPublic))
+                              .execution_options(synchronize_session=False))
+        await session.commit()
+
+    async def backfill_timeline(self, session: AsyncSession, login: str, author: str, limit: int):
+        entries = (select(Friends.login, Posts.id, Posts.author, Posts.createdAt)
+                   .join(Posts, Posts.author == Friends.friend)
+                   .filter(Friends.login == login, Friends.friend == author, visible_to(login, Friends.friend),
+                           ~exists().where(HeavyAuthors.login == author))
+                   .order_by(Posts.createdAt.desc()).limit(limit))
+        await session.execute(insert(Timelines).from_select(["owner", "post_id", "author", "createdAt"], entries)
+                              .on_conflict_do_nothing())
+
+    async def sync_author_timelines(self, session: AsyncSession, author: str, isPublic: bool, limit: int):
+        if not isPublic:
+            await session.execute(delete(Timelines)
+                                  .filter(Timelines.author == author,
+                                          ~exists().where(Friends.login == author, Friends.friend == Timelines.owner))
+                                  .execution_options(synchronize_session=False))
+            return
+
+        recent = (select(Posts.id, Posts.author, Posts.createdAt).filter(Posts.author == author)
+                  .order_by(Posts.createdAt.desc()).limit(limit).subquery())
+        entries = (select(Friends.login, recent.c.id, recent.c.author, recent.c.createdAt)
+                   .join(recent, true())
+                   .filter(Friends.friend == author, ~exists().where(HeavyAuthors.login == author)))
+        await session.execute(insert(Timelines).from_select(["owner", "post_id", "author", "createdAt"], entries)
+                              .on_conflict_do_nothing())
+
+    async def delete_expired_tokens(self, session: AsyncSession, before: float, limit: int) -> int:
+        expired = select(Tokens.id).filter(Tokens.creation_time <= before).limit(limit)
+        sql_query = (delete(Tokens).filter(Tokens.id.in_(expired.scalar_subquery()))
+                     .execution_options(synchronize_session=False))
+        result = await session.execute(sql_query)
+        await session.commit()
+
+        return result.rowcount
+
+    async def trim_tokens_by_login(self, session: AsyncSession, login: str, keep: int) -> List[str]:
+        newest = select(Tokens.id).filter(Tokens.login == login).order_by(Tokens.id.desc()).limit(keep)
+        sql_query = (delete(Tokens).filter(Tokens.login == login, Tokens.id.not_in(newest.scalar_subquery()))
+                     .returning(Tokens.token).execution_options(synchronize_session=False))
+        result = await session.execute(sql_query)
+        await session.commit()
+
+        return list(result.scalars())
@@ -0,0 +1,52 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error
+from datetime import datetime
+from typing import List, Optional
+import orjson
+
+
+def encode_cursor(*values) -> str:
+    return urlsafe_b64encode(orjson.dumps(values)).decode("ascii")
+
+
+def decode_cursor(cursor: str, size: int = 2) -> Optional[List]:
+    try:
+        values = orjson.loads(urlsafe_b64decode(cursor.encode("ascii")))
+    except (Error, ValueError, UnicodeEncodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def encode_time_cursor(moment: datetime, key) -> str:
+    return encode_cursor(moment.isoformat(), key)
+
+
+def decode_time_cursor(cursor: str, key_type: type) -> Optional[List]:
+    values = decode_cursor(cursor)
+    if values is None or not isinstance(values[0], str):
+        return None
+    if isinstance(values[1], bool) or not isinstance(values[1], key_type):
+        return None
+    try:
+        moment = datetime.fromisoformat(values[0])
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        return None
+    return [moment, values[1]]
+
+
+def encode_rank_cursor(rank: float, moment: datetime, key) -> str:
+    return encode_cursor(rank, moment.isoformat(), key)
+
+
+def decode_rank_cursor(cursor: str, key_type: type) -> Optional[List]:
+    values = decode_cursor(cursor, 3)
+    if values is None or isinstance(values[0], bool) or not isinstance(values[0], (int, float)):
+        return None
+    moment = decode_time_cursor(encode_cursor(*values[1:]), key_type)
+    if moment is None:
+        return None
+    return [values[0], *moment]
@@ -1,11 +1,125 @@
+from random import choice
+from time import perf_counter, time
+from typing import Optional
 from settings import get_settings
-from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import create_engine
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 settings = get_settings()
-database_url = f"postgresql+psycopg2://{settings.POSTGRES_USERNAME}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DATABASE}"
-engine = create_engine(database_url)
+database_url = f"postgresql+asyncpg://{settings.POSTGRES_USERNAME}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DATABASE}"
+replica_urls = [f"postgresql+asyncpg://{settings.POSTGRES_USERNAME}:{settings.POSTGRES_PASSWORD}@{host}/{settings.POSTGRES_DATABASE}"
+                for host in settings.POSTGRES_REPLICA_HOSTS]
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def observe(self, wait_time: float) -> None:
+        self.checkouts += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.observe(perf_counter() - started)
+
+
+def make_engine(url: str):
+    return create_async_engine(url, poolclass=TimedQueuePool,
+                               pool_size=settings.POOL_SIZE,
+                               max_overflow=settings.POOL_MAX_OVERFLOW,
+                               pool_timeout=settings.POOL_TIMEOUT,
+                               pool_pre_ping=settings.POOL_PRE_PING,
+                               pool_recycle=settings.POOL_RECYCLE,
+                               connect_args={"server_settings": {
+                                   "statement_timeout": str(settings.STATEMENT_TIMEOUT)}})
+
+
+engine = make_engine(database_url)
+replica_engines = [make_engine(url) for url in replica_urls]
+RECORD_WRITE = text("""INSERT INTO recent_writes (login, written_at) VALUES (:login, :written_at)
+    ON CONFLICT (login) DO UPDATE SET written_at = excluded.written_at""")
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not replica_engines or self.info.get("primary"):
+            return engine.sync_engine
+
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["primary"] = True
+            return engine.sync_engine
+
+        if clause is not None and clause.get_execution_options().get("use_primary"):
+            return engine.sync_engine
+
+        if time() - self.info.get("last_write", 0.0) < settings.READ_YOUR_WRITES_WINDOW:
+            return engine.sync_engine
+
+        if "replica" not in self.info:
+            self.info["replica"] = choice(replica_engines)
+        return self.info["replica"].sync_engine
+
+
+# the last write of a login is kept on the primary, so every worker routes that login's next reads the same way
+@event.listens_for(RoutingSession, "before_commit")
+def record_write(session) -> None:
+    login = session.info.get("login")
+    if replica_engines and login is not None and session.info.get("primary"):
+        session.execute(RECORD_WRITE, {"login": login, "written_at": time()})
+
+
+session_maker = async_sessionmaker(bind=engine, sync_session_class=RoutingSession, expire_on_commit=False)
 
 
 class Base(DeclarativeBase):
     pass
+
+
+async def get_session():
+    async with session_maker() as session:
+        yield session
+
+
+def bind_login(session, login: str, last_write: Optional[float] = None) -> None:
+    session.info["login"] = login
+    if last_write is not None:
+        session.info["last_write"] = last_write
+
+
+def get_engine_pool_status(database_engine) -> dict:
+    pool = database_engine.pool
+    return {"size": pool.size(), "checked_in": pool.checkedin(), "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(), "max_overflow": settings.POOL_MAX_OVERFLOW,
+            "checkouts": pool.stats.checkouts, "timeouts": pool.stats.timeouts,
+            "wait_time": pool.stats.wait_time, "max_wait_time": pool.stats.max_wait_time}
+
+
+def get_pool_status() -> dict:
+    return {**get_engine_pool_status(engine), "replicas": len(replica_engines),
+            "replica_pools": [get_engine_pool_status(replica) for replica in replica_engines]}
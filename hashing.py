@@ -0,0 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from settings import get_settings
+from validators import get_hash, check_hash
+
+settings = get_settings()
+executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(executor, get_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(executor, check_hash, password, password_hash)
@@ -1,12 +1,29 @@
+import asyncio
+import logging
+import orjson
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter, status, Query, Response, Header, Depends, Request
 from fastapi.exceptions import RequestValidationError
-from sqlalchemy.orm import sessionmaker
-from starlette.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError, TimeoutError
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from settings import get_settings
 from reasons import get_reasons
 from crud import CRUD
-from datetime import datetime
+from db import engine, replica_engines, get_session, session_maker, get_pool_status, bind_login
+from metrics import MetricsMiddleware, metrics, instrument_engine
+from security import InvalidToken, get_current_login, invalidate_token, invalidate_tokens, tokens_cache, \
+    require_metrics_token
+from sweeper import sweep_tokens
+from counters import reaction_counters, flush_reactions
+from catalogue import catalogue, etag_matches, refresh_catalogue
+from serializers import dump_profile, dump_post, dump_friend
+from hashing import hash_password, verify_password
+from visibility import can_see, visible_authors, invalidate_friendship, invalidate_author, visibility_cache
+from profile_cache import load_profile, load_profiles, invalidate_profile, profiles_cache
+from migrations import create_db
+from cursors import encode_time_cursor, decode_time_cursor, encode_rank_cursor, decode_rank_cursor
+from datetime import datetime, timezone
 from uuid import uuid4
 from time import time
 from models import *
@@ -15,25 +32,43 @@ from validators import *
 from typing import *
 from const import *
 
-api = FastAPI()
-countries = APIRouter()
-auth = APIRouter()
-me = APIRouter()
-profiles = APIRouter()
-friends = APIRouter()
-posts = APIRouter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with session_maker() as session:
+        await catalogue.load(session)
+    tasks = [asyncio.create_task(sweep_tokens()), asyncio.create_task(refresh_catalogue())]
+    if settings.REACTION_WRITE_BEHIND:
+        tasks.append(asyncio.create_task(flush_reactions()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+api = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+api.add_middleware(MetricsMiddleware)
+countries = APIRouter(tags=["countries"])
+auth = APIRouter(tags=["auth"])
+me = APIRouter(tags=["me"])
+profiles = APIRouter(tags=["profiles"])
+friends = APIRouter(tags=["friends"])
+posts = APIRouter(tags=["posts"])
 routers = [countries, auth, me, profiles, friends, posts]
 
 reasons = get_reasons()
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
-session_maker = sessionmaker(bind=engine)
 db = CRUD()
+for database_engine in [engine, *replica_engines]:
+    instrument_engine(database_engine)
 
 
-def get_session():
-    with session_maker() as session:
-        yield session
+def post_response(post: Posts, counts: Optional[Tuple[int, int]] = None) -> dict:
+    likesCount, dislikesCount = counts if counts is not None else (post.likesCount, post.dislikesCount)
+    likesCount, dislikesCount = reaction_counters.merge(post.id, likesCount, dislikesCount)
+    return dump_post(post, likesCount, dislikesCount)
 
 
 version = "v1"
@@ -45,68 +80,93 @@ async def ping():
     return Status(status=OK)
 
 
-@countries.get(prefix + "countries", status_code=200)
-async def get_list_countries(response: Response, region: List[str] = Query(None), session=Depends(get_session)):
-    array_countries = db.get_countries(session)
-    array_countries = list(array_countries)
+@api.get("/metrics", status_code=200, dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    pool_status = get_pool_status()
+    replica_pools = pool_status.pop("replica_pools")
+    gauges = {f"db_pool_{name}": value for name, value in pool_status.items()}
+    for index, replica_pool in enumerate(replica_pools):
+        gauges.update({f"db_replica{index}_pool_{name}": value for name, value in replica_pool.items()})
+    for name, cache in (("tokens", tokens_cache), ("visibility", visibility_cache), ("profiles", profiles_cache)):
+        gauges.update({f"cache_{name}_{key}": value for key, value in cache.stats().items()})
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@api.get(prefix + "stats/caches", status_code=200, dependencies=[Depends(require_metrics_token)])
+async def get_cache_stats():
+    return {"tokens": tokens_cache.stats(), "visibility": visibility_cache.stats(),
+            "profiles": profiles_cache.stats()}
+
 
+@api.get(prefix + "stats/pool", status_code=200, dependencies=[Depends(require_metrics_token)])
+async def get_pool_stats():
+    return get_pool_status()
+
+
+@countries.get(prefix + "countries", status_code=200)
+async def get_list_countries(response: Response, region: List[str] = Query(None),
+                             If_None_Match: Optional[str] = Header(default=None)):
     if region is None or region == [""]:
-        array_countries = [Country(name=country.name, alpha2=country.alpha2,
-                                   alpha3=country.alpha3, region=country.region) for country in array_countries]
-        return array_countries
+        regions = frozenset()
     elif any(item not in ENUM for item in region):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
     else:
-        array_countries = [country for country in array_countries if country.region in region]
-        array_countries = [Country(name=country.name, alpha2=country.alpha2,
-                                   alpha3=country.alpha3, region=country.region) for country in array_countries]
-        return array_countries
+        regions = frozenset(region)
+
+    body, etag = catalogue.response(regions)
+
+    if If_None_Match is not None and etag_matches(If_None_Match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @countries.get(prefix + "countries/{alpha2}", status_code=200)
-async def get_country(alpha2: str, response: Response, session=Depends(get_session)):
+async def get_country(alpha2: str, response: Response):
     if not validate_countryCode(alpha2):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
-    country = db.get_country_by_alpha2(session, alpha2)
-    country = country.one_or_none()
+    country = catalogue.get(alpha2)
 
     if country is None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return ErrorResponse(reason=reasons.invalid_alpha2)
-    return Country(name=country.name, alpha2=country.alpha2,
-                   alpha3=country.alpha3, region=country.region)
+    return country
 
 
 @auth.post(prefix + "auth/register", status_code=201)
 async def post_register_a_user(user_data: User, response: Response, session=Depends(get_session)):
-    array_users = db.get_users(session)
-    array_users = list(array_users)
+    bind_login(session, user_data.login)
+    user = (await db.get_user_by_credentials(session, user_data.login, user_data.email,
+                                             user_data.phone)).one_or_none()
 
-    for user in array_users:
-        if user_data.login == user.login or user_data.email == user.email or (
-                user_data.phone == user.phone and user_data.phone is not None):
-            response.status_code = status.HTTP_409_CONFLICT
-            return ErrorResponse(reason=reasons.invalid_unique)
+    if user is not None:
+        response.status_code = status.HTTP_409_CONFLICT
+        return ErrorResponse(reason=reasons.invalid_unique)
 
     if not validate_data(user_data):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
-    new_user = Users(login=user_data.login, password=get_hash(user_data.password), email=user_data.email,
+    new_user = Users(login=user_data.login, password=await hash_password(user_data.password), email=user_data.email,
                      phone=user_data.phone,
                      countryCode=user_data.countryCode, isPublic=user_data.isPublic, image=user_data.image)
 
-    db.post_create_user(session, new_user)
+    try:
+        await db.post_create_user(session, new_user)
+    except IntegrityError:
+        await session.rollback()
+        response.status_code = status.HTTP_409_CONFLICT
+        return ErrorResponse(reason=reasons.invalid_unique)
 
-    return validate_profile(user_data)
+    return ORJSONResponse({"profile": dump_profile(user_data)}, status_code=status.HTTP_201_CREATED)
 
 
 @auth.post(prefix + "auth/sign-in", status_code=200)
 async def post_sing_in(user_data: SingInUser, response: Response, session=Depends(get_session)):
-    user = (db.get_user_by_login(session, user_data.login)).one_or_none()
+    bind_login(session, user_data.login)
+    user = (await db.get_user_by_login(session, user_data.login)).one_or_none()
 
     if user is None:
         response.status_code = status.HTTP_401_UNAUTHORIZED
@@ -116,289 +176,162 @@ async def post_sing_in(user_data: SingInUser, response: Response, session=Depend
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
-    if get_hash(user_data.password) != user.password:
+    if not await verify_password(user_data.password, user.password):
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return ErrorResponse(reason=reasons.invalid_login_password)
 
+    if needs_rehash(user.password):
+        await db.update_password_by_login(session, user.login, await hash_password(user_data.password))
+
     token_value = str(uuid4())
     token = Tokens(login=user_data.login, token=token_value, creation_time=time())
-    db.post_create_token(session, token)
+    await db.post_create_token(session, token)
+
+    for evicted in await db.trim_tokens_by_login(session, user_data.login, settings.TOKENS_PER_LOGIN):
+        invalidate_token(evicted)
+
     return Token(token=token_value)
 
 
 @me.get(prefix + "me/profile", status_code=200)
-async def get_my_profile(response: Response, Authorization: Optional[str] = Header(default=None),
+async def get_my_profile(response: Response, current_login: str = Depends(get_current_login),
                          session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    _, body = await load_profile(session, current_login)
 
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    user = (db.get_user_by_login(session, token.login)).one()
-
-    return validate_user(User(login=user.login, password=user.password, email=user.email, countryCode=user.countryCode,
-                              isPublic=user.isPublic, phone=user.phone, image=user.image))
+    return Response(content=body, media_type="application/json")
 
 
 @me.patch(prefix + "me/profile", status_code=200)
 async def patch_my_profile(response: Response, user_data: UpdateProfile,
-                           Authorization: Optional[str] = Header(default=None), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
+                           current_login: str = Depends(get_current_login), session=Depends(get_session)):
     if not validate_update_profile(user_data):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
     if user_data.countryCode is not None:
-        country = (db.get_country_by_alpha2(session, user_data.countryCode)).one_or_none()
-        if country is None:
+        if catalogue.get(user_data.countryCode) is None:
             response.status_code = status.HTTP_400_BAD_REQUEST
             return ErrorResponse(reason=reasons.invalid_data)
 
     if user_data.phone is not None:
-        user = (db.get_user_by_phone(session, user_data.phone)).one_or_none()
+        user = (await db.get_user_by_phone(session, user_data.phone)).one_or_none()
         if user is not None:
             response.status_code = status.HTTP_409_CONFLICT
             return ErrorResponse(reason=reasons.invalid_unique)
 
-    db.update_user_by_login(session, token.login, user_data)
-    user = (db.get_user_by_login(session, token.login)).one()
+    await db.update_user_by_login(session, current_login, user_data, settings.TIMELINE_BACKFILL)
+    invalidate_profile(current_login)
+    if user_data.isPublic is not None:
+        invalidate_author(current_login)
+    user = (await db.get_user_by_login(session, current_login)).one()
 
-    return validate_user(
-        User(login=user.login, password=user.password, email=user.email, countryCode=user.countryCode,
-             isPublic=user.isPublic, phone=user.phone, image=user.image))
+    return ORJSONResponse(dump_profile(user))
 
 
 @me.post(prefix + "me/updatePassword", status_code=200)
 async def update_my_password(response: Response, user_data: UpdatePassword,
-                             Authorization: Optional[str] = Header(default=None), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
+                             current_login: str = Depends(get_current_login), session=Depends(get_session)):
     if not validate_password(user_data.newPassword):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
-    user = (db.get_user_by_login(session, token.login)).one()
+    user = (await db.get_user_by_login(session, current_login)).one()
 
-    if get_hash(user_data.oldPassword) != user.password:
+    if not await verify_password(user_data.oldPassword, user.password):
         response.status_code = status.HTTP_403_FORBIDDEN
         return ErrorResponse(reason=reasons.invalid_login_password)
 
-    db.update_password_by_login(session, user.login, user_data.newPassword)
-    db.delete_tokens_by_login(session, user.login)
+    await db.update_password_by_login(session, user.login, await hash_password(user_data.newPassword))
+    await db.delete_tokens_by_login(session, user.login)
+    invalidate_tokens(user.login)
+    invalidate_profile(user.login)
     return Status(status=OK)
 
 
-@profiles.get(prefix + "profiles/{login}", status_code=200)
-async def get_profile(response: Response, login: str,
-                      Authorization: Optional[str] = Header(default=None), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
+@profiles.get(prefix + "profiles", status_code=200)
+async def get_profiles(response: Response,
+                       logins: List[str] = Query(..., alias="login"),
+                       current_login: str = Depends(get_current_login), session=Depends(get_session)):
+    if not validate_batch(logins):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    found = await load_profiles(session, logins)
+    allowed = await visible_authors(session, current_login, found)
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    items = []
+    for user_login in logins:
+        if user_login in allowed:
+            items.append({"login": user_login, "profile": orjson.Fragment(found[user_login][1])})
+        else:
+            items.append({"login": user_login,
+                          "error": {"status": status.HTTP_403_FORBIDDEN, "reason": reasons.invalid_data}})
+    return ORJSONResponse(items)
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
 
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+@profiles.get(prefix + "profiles/{login}", status_code=200)
+async def get_profile(response: Response, login: str,
+                      current_login: str = Depends(get_current_login), session=Depends(get_session)):
+    profile = await load_profile(session, login)
 
-    user = (db.get_user_by_login(session, login)).one_or_none()
+    if profile is None:
+        response.status_code = status.HTTP_403_FORBIDDEN
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if login == token.login:
-        return validate_user(
-            User(login=user.login, password=user.password, email=user.email, countryCode=user.countryCode,
-                 isPublic=user.isPublic, phone=user.phone, image=user.image))
+    isPublic, body = profile
 
-    if user is None:
+    if not await can_see(session, current_login, login, isPublic):
         response.status_code = status.HTTP_403_FORBIDDEN
         return ErrorResponse(reason=reasons.invalid_data)
 
-    if not user.isPublic:
-        array_friends = (db.get_friends_by_login(session, login)).all()
-        if any(friend.friend == token.login for friend in array_friends):
-            return validate_user(
-                User(login=user.login, password=user.password, email=user.email, countryCode=user.countryCode,
-                     isPublic=user.isPublic, phone=user.phone, image=user.image))
-        else:
-            response.status_code = status.HTTP_403_FORBIDDEN
-            return ErrorResponse(reason=reasons.invalid_data)
-
-    return validate_user(
-        User(login=user.login, password=user.password, email=user.email, countryCode=user.countryCode,
-             isPublic=user.isPublic, phone=user.phone, image=user.image))
+    return Response(content=body, media_type="application/json")
 
 
 @friends.post(prefix + "friends/add", status_code=200)
 async def post_add_friend(response: Response, user_data: AddFriend,
-                          Authorization: Optional[str] = Header(default=None), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    user = (db.get_user_by_login(session, user_data.login)).one_or_none()
+                          current_login: str = Depends(get_current_login), session=Depends(get_session)):
+    user = (await db.get_user_by_login(session, user_data.login)).one_or_none()
 
     if user is None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return ErrorResponse(reason=reasons.invalid_data)
 
-    already = (db.get_friend_by_login(session, token.login, user_data.login)).one_or_none()
+    already = (await db.get_friend_by_login(session, current_login, user_data.login)).one_or_none()
 
     if already is not None:
         return Status(status=OK)
 
-    date = datetime.now().strftime(TIME_PATTERN) + "07:00"
-    db.post_create_friend(session, Friends(login=token.login, friend=user_data.login, addedAt=date))
+    date = datetime.now(timezone.utc)
+    try:
+        await db.post_create_friend(session, Friends(login=current_login, friend=user_data.login, addedAt=date),
+                                    settings.TIMELINE_BACKFILL)
+    except IntegrityError:
+        # a concurrent request added the same friend first
+        await session.rollback()
+        return Status(status=OK)
+    invalidate_friendship(current_login, user_data.login)
     return Status(status=OK)
 
 
 @friends.post(prefix + "friends/remove", status_code=200)
-async def post_add_friend(response: Response, user_data: RemoveFriend,
-                          Authorization: Optional[str] = Header(default=None), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    already = (db.get_friend_by_login(session, token.login, user_data.login)).one_or_none()
+async def post_remove_friend(response: Response, user_data: RemoveFriend,
+                             current_login: str = Depends(get_current_login), session=Depends(get_session)):
+    already = (await db.get_friend_by_login(session, current_login, user_data.login)).one_or_none()
 
     if already is None:
         return Status(status=OK)
 
-    db.delete_friend(session, already)
+    await db.delete_friend(session, already)
+    invalidate_friendship(current_login, user_data.login)
     return Status(status=OK)
 
 
 @friends.get(prefix + "friends", status_code=200)
 async def get_my_friends(response: Response,
-                         Authorization: Optional[str] = Header(default=None),
+                         current_login: str = Depends(get_current_login),
                          limit: Optional[int] = Query(5),
-                         offset: Optional[int] = Query(0), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
-
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
+                         offset: Optional[int] = Query(0),
+                         cursor: Optional[str] = Query(None), session=Depends(get_session)):
     if not validate_limit(limit):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_token)
@@ -407,441 +340,292 @@ async def get_my_friends(response: Response,
         response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_token)
 
-    array_friends = (db.get_friends_by_login(session, token.login)).all()
-    array_friends = sorted(array_friends,
-                           key=lambda friend: datetime.strptime(friend.addedAt[:-5], TIME_PATTERN),
-                           reverse=True)
-    array_friends = array_friends[offset:]
-    array_friends = array_friends[:limit]
-    return [Friend(login=friend.friend, addedAt=friend.addedAt) for friend in array_friends]
+    page_cursor = decode_time_cursor(cursor, int) if cursor is not None else None
+
+    if cursor is not None and page_cursor is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
+
+    array_friends = (await db.get_friends_page(session, current_login, limit, offset, page_cursor)).all()
+
+    headers = {}
+    if array_friends and len(array_friends) == limit:
+        headers["X-Next-Cursor"] = encode_time_cursor(array_friends[-1].addedAt, array_friends[-1].id)
+    return ORJSONResponse([dump_friend(friend) for friend in array_friends], headers=headers)
 
 
 @posts.post(prefix + "posts/new", status_code=200)
 async def post_add_post(response: Response,
                         post_data: AddPost,
-                        Authorization: Optional[str] = Header(default=None),
+                        current_login: str = Depends(get_current_login),
                         session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
+    if not validate_content(post_data.content):
+        response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_token)
 
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
+    if not validate_tags(post_data.tags):
+        response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_token)
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    post_id = str(uuid4())
+    date = datetime.now(timezone.utc)
+    new_post = Posts(id=post_id, author=current_login, content=post_data.content,
+                     tags=post_data.tags, createdAt=date, likesCount=0, dislikesCount=0)
+    await db.post_create_post(session, new_post, settings.TIMELINE_FANOUT_LIMIT)
+    return ORJSONResponse(dump_post(new_post, 0, 0))
+
+
+@posts.get(prefix + "posts/timeline", status_code=200)
+async def get_timeline(response: Response,
+                       current_login: str = Depends(get_current_login),
+                       limit: Optional[int] = Query(5),
+                       offset: Optional[int] = Query(0),
+                       cursor: Optional[str] = Query(None), session=Depends(get_session)):
+    if not validate_limit(limit) or not validate_offset(offset):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    page_cursor = decode_time_cursor(cursor, str) if cursor is not None else None
 
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    if cursor is not None and page_cursor is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if not validate_content(post_data.content):
+    array_posts = (await db.get_timeline_page(session, current_login, limit, offset, page_cursor)).all()
+
+    headers = {}
+    if array_posts and len(array_posts) == limit:
+        headers["X-Next-Cursor"] = encode_time_cursor(array_posts[-1].createdAt, array_posts[-1].id)
+    return ORJSONResponse([post_response(post) for post in array_posts], headers=headers)
+
+
+@posts.get(prefix + "posts/tags/{tag}", status_code=200)
+async def get_tag_feed(response: Response,
+                       tag: str,
+                       current_login: str = Depends(get_current_login),
+                       limit: Optional[int] = Query(5),
+                       offset: Optional[int] = Query(0),
+                       cursor: Optional[str] = Query(None), session=Depends(get_session)):
+    if not validate_tags([tag]) or not validate_limit(limit) or not validate_offset(offset):
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return ErrorResponse(reason=reasons.invalid_token)
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if not validate_tags(post_data.tags):
+    page_cursor = decode_time_cursor(cursor, str) if cursor is not None else None
+
+    if cursor is not None and page_cursor is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return ErrorResponse(reason=reasons.invalid_token)
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    post_id = str(uuid4())
-    date = datetime.now().strftime(TIME_PATTERN) + "07:00"
-    db.post_create_post(session, Posts(id=post_id, author=token.login, content=post_data.content,
-                                       tags=post_data.tags, createdAt=date,
-                                       likesCount=0, dislikesCount=0))
-    return Post(id=post_id, author=token.login, content=post_data.content,
-                tags=post_data.tags, createdAt=date,
-                likesCount=0, dislikesCount=0)
+    array_posts = (await db.get_tag_page(session, current_login, tag, limit, offset, page_cursor)).all()
 
+    headers = {}
+    if array_posts and len(array_posts) == limit:
+        headers["X-Next-Cursor"] = encode_time_cursor(array_posts[-1].createdAt, array_posts[-1].id)
+    return ORJSONResponse([post_response(post) for post in array_posts], headers=headers)
 
-@posts.get(prefix + "posts/{postId}", status_code=200)
-async def get_post(response: Response,
-                   postId: str,
-                   Authorization: Optional[str] = Header(default=None),
-                   session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
 
-    token = Authorization.split()
+@posts.get(prefix + "posts/search", status_code=200)
+async def search_posts(response: Response,
+                       q: str,
+                       current_login: str = Depends(get_current_login),
+                       limit: Optional[int] = Query(5),
+                       offset: Optional[int] = Query(0),
+                       cursor: Optional[str] = Query(None), session=Depends(get_session)):
+    if not validate_query(q) or not validate_limit(limit) or not validate_offset(offset):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    page_cursor = decode_rank_cursor(cursor, str) if cursor is not None else None
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    if cursor is not None and page_cursor is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    found = (await db.search_posts(session, current_login, q, limit, offset, page_cursor)).all()
 
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    headers = {}
+    if found and len(found) == limit:
+        post, rank = found[-1]
+        headers["X-Next-Cursor"] = encode_rank_cursor(rank, post.createdAt, post.id)
+    return ORJSONResponse([post_response(post) for post, _ in found], headers=headers)
 
-    post = (db.get_post_by_id(session, postId)).one_or_none()
 
-    if post is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
+@posts.get(prefix + "posts", status_code=200)
+async def get_posts(response: Response,
+                    ids: List[str] = Query(..., alias="id"),
+                    current_login: str = Depends(get_current_login),
+                    session=Depends(get_session)):
+    if not validate_batch(ids):
+        response.status_code = status.HTTP_400_BAD_REQUEST
         return ErrorResponse(reason=reasons.invalid_data)
 
-    author = (db.get_user_by_login(session, post.author)).one()
+    found = {post.id: post for post in (await db.get_posts_by_ids(session, list(set(ids)))).all()}
+    allowed = await visible_authors(session, current_login, (post.author for post in found.values()))
 
-    if token.login == author.login:
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
-
-    if not author.isPublic:
-        array_friends = (db.get_friends_by_login(session, author.login)).all()
-        if any(friend.friend == token.login for friend in array_friends):
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
+    items = []
+    for postId in ids:
+        post = found.get(postId)
+        if post is not None and post.author in allowed:
+            items.append({"id": postId, "post": post_response(post)})
         else:
-            response.status_code = status.HTTP_404_NOT_FOUND
-            return ErrorResponse(reason=reasons.invalid_data)
+            items.append({"id": postId, "error": {"status": status.HTTP_404_NOT_FOUND, "reason": reasons.invalid_data}})
+    return ORJSONResponse(items)
 
-    return Post(id=post.id, content=post.content, author=post.author,
-                tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                dislikesCount=post.dislikesCount)
+
+@posts.get(prefix + "posts/{postId}", status_code=200)
+async def get_post(response: Response,
+                   postId: str,
+                   current_login: str = Depends(get_current_login),
+                   session=Depends(get_session)):
+    post = (await db.get_post_by_id(session, postId)).one_or_none()
+
+    if post is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return ErrorResponse(reason=reasons.invalid_data)
+
+    if not await can_see(session, current_login, post.author):
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return ErrorResponse(reason=reasons.invalid_data)
+
+    return ORJSONResponse(post_response(post))
 
 
 @posts.get(prefix + "posts/feed/my", status_code=200)
 async def get_my_feed(response: Response,
-                      Authorization: Optional[str] = Header(default=None),
+                      current_login: str = Depends(get_current_login),
                       limit: Optional[int] = Query(5),
-                      offset: Optional[int] = Query(0), session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+                      offset: Optional[int] = Query(0),
+                      cursor: Optional[str] = Query(None), session=Depends(get_session)):
+    if not validate_limit(limit) or not validate_offset(offset):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    page_cursor = decode_time_cursor(cursor, str) if cursor is not None else None
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    if cursor is not None and page_cursor is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    array_posts = (await db.get_posts_page(session, current_login, limit, offset, page_cursor)).all()
 
-    array_posts = (db.get_posts_by_login(session, token.login)).all()
-    array_posts = sorted(array_posts, key=lambda post: datetime.strptime(post.createdAt[:-5], TIME_PATTERN),
-                         reverse=True)
-    array_posts = array_posts[offset:]
-    array_posts = array_posts[:limit]
-    return [Post(id=post.id, content=post.content, author=post.author,
-                 tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                 dislikesCount=post.dislikesCount) for post in array_posts]
+    headers = {}
+    if array_posts and len(array_posts) == limit:
+        headers["X-Next-Cursor"] = encode_time_cursor(array_posts[-1].createdAt, array_posts[-1].id)
+    return ORJSONResponse([post_response(post) for post in array_posts], headers=headers)
 
 
 @posts.get(prefix + "posts/feed/{login}", status_code=200)
 async def get_feed(response: Response,
                    login: str,
-                   Authorization: Optional[str] = Header(default=None),
+                   current_login: str = Depends(get_current_login),
                    limit: Optional[int] = Query(5),
                    offset: Optional[int] = Query(0),
+                   cursor: Optional[str] = Query(None),
                    session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    if not validate_limit(limit) or not validate_offset(offset):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    page_cursor = decode_time_cursor(cursor, str) if cursor is not None else None
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    if cursor is not None and page_cursor is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    author = (db.get_user_by_login(session, login)).one_or_none()
+    author = (await db.get_user_by_login(session, login)).one_or_none()
 
     if author is None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return ErrorResponse(reason=reasons.invalid_token)
 
-    array_posts = (db.get_posts_by_login(session, login)).all()
-    array_posts = sorted(array_posts, key=lambda post: datetime.strptime(post.createdAt[:-5], TIME_PATTERN),
-                         reverse=True)
-
-    if token.login == author.login:
-        array_posts = array_posts[offset:]
-        array_posts = array_posts[:limit]
-        return [Post(id=post.id, content=post.content, author=post.author,
-                     tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                     dislikesCount=post.dislikesCount) for post in array_posts]
-
-    if not author.isPublic:
-        array_friends = (db.get_friends_by_login(session, author.login)).all()
-        if any(friend.friend == token.login for friend in array_friends):
-            return [Post(id=post.id, content=post.content, author=post.author,
-                         tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                         dislikesCount=post.dislikesCount) for post in array_posts]
-        else:
-            response.status_code = status.HTTP_404_NOT_FOUND
-            return ErrorResponse(reason=reasons.invalid_data)
-
-    return [Post(id=post.id, content=post.content, author=post.author,
-                 tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                 dislikesCount=post.dislikesCount) for post in array_posts]
-
-
-@posts.post(prefix + "posts/{postId}/like", status_code=200)
-async def post_like_post(response: Response,
-                         postId: str,
-                         Authorization: Optional[str] = Header(default=None),
-                         session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    if not await can_see(session, current_login, author.login, author.isPublic):
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return ErrorResponse(reason=reasons.invalid_data)
 
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    array_posts = (await db.get_posts_page(session, login, limit, offset, page_cursor)).all()
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
+    headers = {}
+    if array_posts and len(array_posts) == limit:
+        headers["X-Next-Cursor"] = encode_time_cursor(array_posts[-1].createdAt, array_posts[-1].id)
+    return ORJSONResponse([post_response(post) for post in array_posts], headers=headers)
 
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
 
-    post = (db.get_post_by_id(session, postId)).one_or_none()
+async def react_to_post(response: Response, postId: str, current_login: str, session, liked: bool):
+    post = (await db.get_post_by_id(session, postId)).one_or_none()
 
     if post is None:
         response.status_code = status.HTTP_404_NOT_FOUND
         return ErrorResponse(reason=reasons.invalid_data)
 
-    author = (db.get_user_by_login(session, post.author)).one()
-
-    if token.login == author.login:
-        mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-        if mark is None:
-            db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=True))
-            db.increment_like(session, postId)
-            post = (db.get_post_by_id(session, postId)).one()
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-        elif mark.liked:
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-        else:
-            db.change_mark(session, postId, token.login)
-            db.increment_like(session, postId)
-            db.decrement_dislike(session, postId)
-            post = (db.get_post_by_id(session, postId)).one()
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-
-    if not author.isPublic:
-        array_friends = (db.get_friends_by_login(session, author.login)).all()
-        if any(friend.friend == token.login for friend in array_friends):
-            mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-            if mark is None:
-                db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=True))
-                db.increment_like(session, postId)
-                post = (db.get_post_by_id(session, postId)).one()
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-            elif mark.liked:
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-            else:
-                db.change_mark(session, postId, token.login)
-                db.increment_like(session, postId)
-                db.decrement_dislike(session, postId)
-                post = (db.get_post_by_id(session, postId)).one()
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-        else:
-            response.status_code = status.HTTP_404_NOT_FOUND
-            return ErrorResponse(reason=reasons.invalid_data)
+    if not await can_see(session, current_login, post.author):
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return ErrorResponse(reason=reasons.invalid_data)
+
+    if settings.REACTION_WRITE_BEHIND:
+        delta = await db.react_deferred(session, postId, current_login, liked)
+        if delta is not None:
+            reaction_counters.add(postId, *delta)
+        return ORJSONResponse(post_response(post))
+
+    counts = await db.react(session, postId, current_login, liked)
+    return ORJSONResponse(post_response(post, counts))
 
-    mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-    if mark is None:
-        db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=True))
-        db.increment_like(session, postId)
-        post = (db.get_post_by_id(session, postId)).one()
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
-    elif mark.liked:
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
-    else:
-        db.change_mark(session, postId, token.login)
-        db.increment_like(session, postId)
-        db.decrement_dislike(session, postId)
-        post = (db.get_post_by_id(session, postId)).one()
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
+
+@posts.post(prefix + "posts/{postId}/like", status_code=200)
+async def post_like_post(response: Response,
+                         postId: str,
+                         current_login: str = Depends(get_current_login),
+                         session=Depends(get_session)):
+    return await react_to_post(response, postId, current_login, session, liked=True)
 
 
 @posts.post(prefix + "posts/{postId}/dislike", status_code=200)
 async def post_dislike_post(response: Response,
                             postId: str,
-                            Authorization: Optional[str] = Header(default=None),
+                            current_login: str = Depends(get_current_login),
                             session=Depends(get_session)):
-    if Authorization is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = Authorization.split()
-
-    if len(token) != 2:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    token = token[1]
-    token = (db.get_token_by_token(session, token)).one_or_none()
+    return await react_to_post(response, postId, current_login, session, liked=False)
 
-    if token is None:
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
-
-    if time() - token.creation_time >= DAY_TIME:
-        db.delete_token(session, token)
-        response.status_code = status.HTTP_401_UNAUTHORIZED
-        return ErrorResponse(reason=reasons.invalid_token)
 
-    post = (db.get_post_by_id(session, postId)).one_or_none()
-
-    if post is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return ErrorResponse(reason=reasons.invalid_data)
+@api.exception_handler(InvalidToken)
+async def invalid_token_error(request: Request, exc):
+    return ORJSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={"reason": reasons.invalid_token}
+    )
 
-    author = (db.get_user_by_login(session, post.author)).one()
-
-    if token.login == author.login:
-        mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-        if mark is None:
-            db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=False))
-            db.increment_dislike(session, postId)
-            post = (db.get_post_by_id(session, postId)).one()
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-        elif not mark.liked:
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-        else:
-            db.change_mark(session, postId, token.login)
-            db.increment_dislike(session, postId)
-            db.decrement_like(session, postId)
-            post = (db.get_post_by_id(session, postId)).one()
-            return Post(id=post.id, content=post.content, author=post.author,
-                        tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                        dislikesCount=post.dislikesCount)
-
-    if not author.isPublic:
-        array_friends = (db.get_friends_by_login(session, author.login)).all()
-        if any(friend.friend == token.login for friend in array_friends):
-            mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-            if mark is None:
-                db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=False))
-                db.increment_dislike(session, postId)
-                post = (db.get_post_by_id(session, postId)).one()
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-            elif not mark.liked:
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-            else:
-                db.change_mark(session, postId, token.login)
-                db.increment_dislike(session, postId)
-                db.decrement_like(session, postId)
-                post = (db.get_post_by_id(session, postId)).one()
-                return Post(id=post.id, content=post.content, author=post.author,
-                            tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                            dislikesCount=post.dislikesCount)
-        else:
-            response.status_code = status.HTTP_404_NOT_FOUND
-            return ErrorResponse(reason=reasons.invalid_data)
 
-    mark = (db.get_mark_for_post(session, postId, token.login)).one_or_none()
-
-    if mark is None:
-        db.post_create_mark(session, Marks(post_id=postId, login=token.login, liked=False))
-        db.increment_dislike(session, postId)
-        post = (db.get_post_by_id(session, postId)).one()
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
-    elif not mark.liked:
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
-    else:
-        db.change_mark(session, postId, token.login)
-        db.increment_dislike(session, postId)
-        db.decrement_like(session, postId)
-        post = (db.get_post_by_id(session, postId)).one()
-        return Post(id=post.id, content=post.content, author=post.author,
-                    tags=post.tags, createdAt=post.createdAt, likesCount=post.likesCount,
-                    dislikesCount=post.dislikesCount)
+@api.exception_handler(TimeoutError)
+async def pool_timeout_error(request: Request, exc):
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"reason": reasons.unavailable}
+    )
 
 
 @api.exception_handler(RequestValidationError)
 async def validation_error(request: Request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
         content={"reason": reasons.invalid_data}
     )
 
 
+for router in routers:
+    api.include_router(router)
+
+
 if __name__ == "__main__":
-    create_db()
-    for router in routers:
-        api.include_router(router)
-    uvicorn.run(api, host="0.0.0.0", port=settings.SERVER_PORT)
+    if settings.SERVER_WORKERS > 1 and settings.REACTION_WRITE_BEHIND:
+        raise SystemExit("REACTION_WRITE_BEHIND keeps pending reactions in one process, "
+                         "it cannot be combined with SERVER_WORKERS > 1")
+    stale_caches = [name for name, ttl in (("TOKEN_CACHE_TTL", settings.TOKEN_CACHE_TTL),
+                                           ("VISIBILITY_CACHE_TTL", settings.VISIBILITY_CACHE_TTL),
+                                           ("PROFILE_CACHE_TTL", settings.PROFILE_CACHE_TTL)) if ttl > 0]
+    if settings.SERVER_WORKERS > 1 and stale_caches:
+        logger.warning("%d workers with per-process caches enabled (%s): password changes, unfriending and "
+                       "privacy changes take up to the cache TTL to reach the other workers",
+                       settings.SERVER_WORKERS, ", ".join(stale_caches))
+    asyncio.run(create_db())
+    uvicorn.run("main:api", host="0.0.0.0", port=settings.SERVER_PORT, workers=settings.SERVER_WORKERS,
+                loop=settings.SERVER_LOOP, http=settings.SERVER_HTTP, access_log=settings.SERVER_ACCESS_LOG)
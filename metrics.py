@@ -0,0 +1,168 @@
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    __slots__ = ("db_time", "statements", "commits")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.statements = 0
+        self.commits = 0
+
+    @property
+    def round_trips(self) -> int:
+        return self.statements + self.commits
+
+
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_stats", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        total += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {total}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str, str], Histogram] = {}
+        self.db_time: Dict[Tuple[str, str, str], Histogram] = {}
+        self.statements: Dict[Tuple[str, str, str], int] = {}
+
+    def observe(self, router: str, method: str, route: str, status_code: int, latency: float,
+                stats: RequestStats) -> None:
+        key = (router, method, route, status_code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        key = (router, method, route)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+            self.db_time[key] = Histogram()
+        histogram.observe(latency)
+        self.db_time[key].observe(stats.db_time)
+        self.statements[key] = self.statements.get(key, 0) + stats.statements
+
+    def render(self, gauges: Dict[str, float]) -> str:
+        lines = ["# TYPE http_requests_total counter"]
+        for (router, method, route, status_code), count in self.requests.items():
+            lines.append(f'http_requests_total{{router="{router}",method="{method}",route="{route}",'
+                         f'status="{status_code}"}} {count}')
+
+        for name, histograms in (("http_request_duration_seconds", self.latency),
+                                 ("http_request_db_seconds", self.db_time)):
+            lines.append(f"# TYPE {name} histogram")
+            for (router, method, route), histogram in histograms.items():
+                lines.extend(histogram.render(name, f'router="{router}",method="{method}",route="{route}"'))
+
+        lines.append("# TYPE http_request_db_statements_total counter")
+        for (router, method, route), count in self.statements.items():
+            lines.append(f'http_request_db_statements_total{{router="{router}",method="{method}",route="{route}"}} '
+                         f'{count}')
+
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(f"http_requests_in_flight {self.in_flight}")
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.DB_DEBUG_HEADERS:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-queries", str(stats.statements).encode()),
+                        (b"x-db-commits", str(stats.commits).encode()),
+                        (b"x-db-time", f"{stats.db_time * 1000:.3f}".encode())]
+            await send(message)
+
+        metrics.in_flight += 1
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            latency = perf_counter() - started
+            metrics.in_flight -= 1
+            current_stats.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            router = route.tags[0] if getattr(route, "tags", None) else "api"
+            metrics.observe(router, scope["method"], path, status_code, latency, stats)
+
+            if 0 < settings.DB_QUERY_BUDGET < stats.round_trips:
+                logger.warning("%s %s made %d database round trips (%d statements, %d commits), budget is %d",
+                               scope["method"], path, stats.round_trips, stats.statements, stats.commits,
+                               settings.DB_QUERY_BUDGET)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_started"].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.db_time += elapsed
+        stats.statements += 1
+
+
+def _commit(conn):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+
+def instrument_engine(engine) -> None:
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "commit", _commit)
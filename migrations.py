@@ -0,0 +1,146 @@
+import asyncio
+from argparse import ArgumentParser
+from typing import List
+from time import time
+from sqlalchemy import text, inspect, select, insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+from db import Base, engine
+from models import *
+from settings import get_settings
+
+settings = get_settings()
+LOCK_KEY = 20_240_301
+
+# runs before REBUILD_TIMELINES so authors over TIMELINE_FANOUT_LIMIT followers stay pull-only
+MARK_HEAVY_AUTHORS = f"""INSERT INTO heavy_authors (login)
+    SELECT friend FROM friends GROUP BY friend HAVING count(*) > {int(settings.TIMELINE_FANOUT_LIMIT)}
+    ON CONFLICT DO NOTHING"""
+
+REBUILD_TIMELINES = f"""INSERT INTO timelines (owner, post_id, author, "createdAt")
+    SELECT friends.login, recent.id, recent.author, recent."createdAt" FROM friends
+    CROSS JOIN LATERAL (SELECT id, author, "createdAt" FROM posts WHERE posts.author = friends.friend
+                        ORDER BY "createdAt" DESC LIMIT {int(settings.TIMELINE_BACKFILL)}) AS recent
+    WHERE NOT EXISTS (SELECT 1 FROM heavy_authors WHERE heavy_authors.login = friends.friend)
+    AND (EXISTS (SELECT 1 FROM users WHERE users.login = friends.friend AND users."isPublic")
+         OR EXISTS (SELECT 1 FROM friends AS back WHERE back.login = friends.friend AND back.friend = friends.login))
+    ON CONFLICT DO NOTHING"""
+
+# SQL counterpart of validators.normalize_tag, lower() agrees with casefold() except for a few letters such as ß
+NORMALIZED_TAG = "lower(btrim({}, E' \\t\\n\\r\\f'))"
+
+REBUILD_POST_TAGS = f"""INSERT INTO post_tags (tag, post_id, author, "createdAt")
+    SELECT {NORMALIZED_TAG.format("tags.tag")}, posts.id, posts.author, posts."createdAt" FROM posts
+    CROSS JOIN LATERAL json_array_elements_text(posts.tags) AS tags (tag)
+    WHERE {NORMALIZED_TAG.format("tags.tag")} <> ''
+    ON CONFLICT DO NOTHING"""
+
+REBUILDS = {"heavy_authors": MARK_HEAVY_AUTHORS, "timelines": REBUILD_TIMELINES, "post_tags": REBUILD_POST_TAGS}
+
+MIGRATIONS = [
+    (1, "secondary indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_tokens_creation_time ON tokens (creation_time)",
+        "CREATE INDEX IF NOT EXISTS ix_tokens_login ON tokens (login)",
+        "DELETE FROM friends a USING friends b WHERE a.login = b.login AND a.friend = b.friend AND a.id > b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_friends_login_friend ON friends (login, friend)",
+        "CREATE INDEX IF NOT EXISTS ix_friends_friend ON friends (friend)",
+        "DELETE FROM marks a USING marks b WHERE a.post_id = b.post_id AND a.login = b.login AND a.id > b.id",
+        """UPDATE posts SET "likesCount" = counts.likes, "dislikesCount" = counts.dislikes
+           FROM (SELECT post_id, count(*) FILTER (WHERE liked) AS likes, count(*) FILTER (WHERE NOT liked) AS dislikes
+                 FROM marks GROUP BY post_id) AS counts
+           WHERE posts.id = counts.post_id""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_marks_post_id_login ON marks (post_id, login)",
+        "CREATE INDEX IF NOT EXISTS ix_marks_login ON marks (login)",
+        'CREATE INDEX IF NOT EXISTS "ix_posts_author_createdAt" ON posts (author, "createdAt", id)',
+    ]),
+    (2, "friends ordering index", [
+        'CREATE INDEX IF NOT EXISTS "ix_friends_login_addedAt" ON friends (login, "addedAt", id)',
+    ]),
+    (3, "timestamp columns", [
+        """ALTER TABLE posts ALTER COLUMN "createdAt" TYPE timestamptz
+           USING left("createdAt", 19)::timestamp AT TIME ZONE 'UTC'""",
+        """ALTER TABLE friends ALTER COLUMN "addedAt" TYPE timestamptz
+           USING left("addedAt", 19)::timestamp AT TIME ZONE 'UTC'""",
+    ]),
+    (4, "friends timelines", [
+        MARK_HEAVY_AUTHORS,
+        REBUILD_TIMELINES,
+    ]),
+    (5, "post tags index", [
+        REBUILD_POST_TAGS,
+    ]),
+    (6, "posts full-text search", [
+        """ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+           GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, content)) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING gin (search_vector)",
+    ]),
+    (7, "normalized post tags", [
+        f"""INSERT INTO post_tags (tag, post_id, author, "createdAt")
+            SELECT {NORMALIZED_TAG.format("tag")}, post_id, author, "createdAt" FROM post_tags
+            WHERE tag <> {NORMALIZED_TAG.format("tag")} AND {NORMALIZED_TAG.format("tag")} <> ''
+            ON CONFLICT DO NOTHING""",
+        f"DELETE FROM post_tags WHERE tag <> {NORMALIZED_TAG.format('tag')} OR tag = ''",
+    ]),
+    (8, "visible timelines", [
+        """DELETE FROM timelines
+           WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.login = timelines.author AND users."isPublic")
+           AND NOT EXISTS (SELECT 1 FROM friends WHERE friends.login = timelines.author
+                                                   AND friends.friend = timelines.owner)""",
+    ]),
+]
+
+
+async def get_applied_versions(connection: AsyncConnection) -> List[int]:
+    result = await connection.execute(select(SchemaVersions.version).order_by(SchemaVersions.version))
+
+    return list(result.scalars())
+
+
+async def upgrade(connection: AsyncConnection) -> List[int]:
+    await connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+    fresh = not await connection.run_sync(lambda sync_connection: inspect(sync_connection).has_table("users"))
+    await connection.run_sync(Base.metadata.create_all)
+
+    applied = set(await get_applied_versions(connection))
+    pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+    for version, name, statements in pending:
+        # create_all has just built the current schema, so a fresh database only needs the stamp
+        if not fresh:
+            for statement in statements:
+                await connection.execute(text(statement))
+        await connection.execute(insert(SchemaVersions).values(version=version, name=name, applied_at=time()))
+
+    return [migration[0] for migration in pending]
+
+
+async def create_db() -> None:
+    async with engine.begin() as connection:
+        await upgrade(connection)
+    await engine.dispose()
+
+
+async def status() -> None:
+    async with engine.connect() as connection:
+        has_versions = await connection.run_sync(
+            lambda sync_connection: inspect(sync_connection).has_table(SchemaVersions.__tablename__))
+        applied = set(await get_applied_versions(connection)) if has_versions else set()
+    await engine.dispose()
+
+    for version, name, _ in MIGRATIONS:
+        print(f"{version:>4} {'applied' if version in applied else 'pending':<8} {name}")
+
+
+async def rebuild() -> None:
+    async with engine.begin() as connection:
+        for name, statement in REBUILDS.items():
+            result = await connection.execute(text(statement))
+            print(f"{name}: {result.rowcount} rows added")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status", "rebuild"],
+                        help="rebuild re-derives heavy_authors, timelines and post_tags for rows loaded outside the API")
+    args = parser.parse_args()
+    asyncio.run({"upgrade": create_db, "status": status, "rebuild": rebuild}[args.command]())
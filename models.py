@@ -1,7 +1,9 @@
 from typing import List
-from db import Base, engine
+from datetime import datetime
+from db import Base
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Text, Integer, Boolean, Float, JSON
+from sqlalchemy import Text, Integer, Boolean, Float, JSON, Index, DateTime, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 
 class Countries(Base):
@@ -28,37 +30,89 @@ class Users(Base):
 class Tokens(Base):
     __tablename__ = "tokens"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    login: Mapped[str] = mapped_column(Text, nullable=False)
+    login: Mapped[str] = mapped_column(Text, nullable=False, index=True)
     token: Mapped[str] = mapped_column(Text, nullable=False, unique=True)
-    creation_time: Mapped[float] = mapped_column(Float, nullable=False)
+    creation_time: Mapped[float] = mapped_column(Float, nullable=False, index=True)
 
 
 class Friends(Base):
     __tablename__ = "friends"
+    __table_args__ = (
+        Index("ix_friends_login_friend", "login", "friend", unique=True),
+        Index("ix_friends_friend", "friend"),
+        Index("ix_friends_login_addedAt", "login", "addedAt", "id"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     login: Mapped[str] = mapped_column(Text, nullable=False)
     friend: Mapped[str] = mapped_column(Text, nullable=False)
-    addedAt: Mapped[str] = mapped_column(Text, nullable=False)
+    addedAt: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
 
 class Posts(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        Index("ix_posts_author_createdAt", "author", "createdAt", "id"),
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+    )
     id: Mapped[str] = mapped_column(Text, primary_key=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     author: Mapped[str] = mapped_column(Text, nullable=False)
     tags: Mapped[List[str]] = mapped_column(JSON, nullable=False)
-    createdAt: Mapped[str] = mapped_column(Text, nullable=False)
+    createdAt: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     likesCount: Mapped[int] = mapped_column(Integer, nullable=False)
     dislikesCount: Mapped[int] = mapped_column(Integer, nullable=False)
+    search_vector: Mapped[str] = mapped_column(TSVECTOR, Computed("to_tsvector('simple'::regconfig, content)"),
+                                               deferred=True)
 
 
 class Marks(Base):
     __tablename__ = "marks"
+    __table_args__ = (
+        Index("ix_marks_post_id_login", "post_id", "login", unique=True),
+        Index("ix_marks_login", "login"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     post_id: Mapped[str] = mapped_column(Text, nullable=False)
     login: Mapped[str] = mapped_column(Text, nullable=False)
     liked: Mapped[bool] = mapped_column(Boolean, nullable=False)
 
 
-def create_db() -> None:
-    Base.metadata.create_all(engine)
+class Timelines(Base):
+    __tablename__ = "timelines"
+    __table_args__ = (
+        Index("ix_timelines_owner_createdAt", "owner", "createdAt", "post_id", "author"),
+        Index("ix_timelines_owner_author", "owner", "author"),
+    )
+    owner: Mapped[str] = mapped_column(Text, primary_key=True)
+    post_id: Mapped[str] = mapped_column(Text, primary_key=True)
+    author: Mapped[str] = mapped_column(Text, nullable=False)
+    createdAt: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class HeavyAuthors(Base):
+    __tablename__ = "heavy_authors"
+    login: Mapped[str] = mapped_column(Text, primary_key=True)
+
+
+class PostTags(Base):
+    __tablename__ = "post_tags"
+    __table_args__ = (
+        Index("ix_post_tags_tag_createdAt", "tag", "createdAt", "post_id"),
+    )
+    tag: Mapped[str] = mapped_column(Text, primary_key=True)
+    post_id: Mapped[str] = mapped_column(Text, primary_key=True)
+    author: Mapped[str] = mapped_column(Text, nullable=False)
+    createdAt: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class RecentWrites(Base):
+    __tablename__ = "recent_writes"
+    login: Mapped[str] = mapped_column(Text, primary_key=True)
+    written_at: Mapped[float] = mapped_column(Float, nullable=False)
+
+
+class SchemaVersions(Base):
+    __tablename__ = "schema_versions"
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(Text, nullable=False)
+    applied_at: Mapped[float] = mapped_column(Float, nullable=False)
@@ -0,0 +1,45 @@
+from typing import Optional, Tuple, Dict, Iterable
+import orjson
+from cache import TTLCache
+from crud import CRUD
+from serializers import dump_profile
+from settings import get_settings
+
+settings = get_settings()
+profiles_cache = TTLCache(settings.PROFILE_CACHE_SIZE, settings.PROFILE_CACHE_TTL)
+db = CRUD()
+
+
+async def load_profile(session, login: str) -> Optional[Tuple[bool, bytes]]:
+    profile = profiles_cache.get(login)
+
+    if profile is None:
+        user = (await db.get_user_by_login(session, login)).one_or_none()
+        if user is None:
+            return None
+        profile = (user.isPublic, orjson.dumps(dump_profile(user)))
+        profiles_cache.set(login, profile)
+
+    return profile
+
+
+async def load_profiles(session, logins: Iterable[str]) -> Dict[str, Tuple[bool, bytes]]:
+    profiles, missing = {}, []
+    for login in set(logins):
+        profile = profiles_cache.get(login)
+        if profile is None:
+            missing.append(login)
+        else:
+            profiles[login] = profile
+
+    if missing:
+        for user in (await db.get_users_by_logins(session, missing)).all():
+            profile = (user.isPublic, orjson.dumps(dump_profile(user)))
+            profiles_cache.set(user.login, profile)
+            profiles[user.login] = profile
+
+    return profiles
+
+
+def invalidate_profile(login: str) -> None:
+    profiles_cache.pop(login)
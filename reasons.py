@@ -7,6 +7,7 @@ class Reasons:
     invalid_data = "Регистрационные данные не соответствуют ожидаемому формату и требованиям."
     invalid_unique = "Нарушено требование на уникальность авторизационных данных пользователей."
     invalid_alpha2 = "Страна с указанным кодом не найдена."
+    unavailable = "Сервис временно перегружен, повторите запрос позже."
 
 
 @lru_cache
@@ -22,42 +22,6 @@ class User(BaseModel):
     image: Optional[str] = Field(None, min_length=1, max_length=100)
 
 
-class UserProfile(BaseModel):
-    login: str = Field(..., min_length=1, max_length=30, pattern="[a-zA-Z0-9-]+")
-    email: str = Field(..., min_length=1, max_length=50)
-    countryCode: str = Field(..., min_length=2, max_length=2, pattern="[a-zA-Z]{2}",
-                             description="Двухбуквенный код, уникально идентифицирующий страну")
-    isPublic: bool
-    phone: Optional[str] = Field(None, max_length=20, pattern="\+[\d]+")
-    image: Optional[str] = Field(None, min_length=1, max_length=100)
-
-
-class UserProfileWithoutImage(BaseModel):
-    login: str = Field(..., min_length=1, max_length=30, pattern="[a-zA-Z0-9-]+")
-    email: str = Field(..., min_length=1, max_length=50)
-    countryCode: str = Field(..., min_length=2, max_length=2, pattern="[a-zA-Z]{2}",
-                             description="Двухбуквенный код, уникально идентифицирующий страну")
-    isPublic: bool
-    phone: Optional[str] = Field(None, max_length=20, pattern="\+[\d]+")
-
-
-class UserProfileWithoutPhone(BaseModel):
-    login: str = Field(..., min_length=1, max_length=30, pattern="[a-zA-Z0-9-]+")
-    email: str = Field(..., min_length=1, max_length=50)
-    countryCode: str = Field(..., min_length=2, max_length=2, pattern="[a-zA-Z]{2}",
-                             description="Двухбуквенный код, уникально идентифицирующий страну")
-    isPublic: bool
-    image: Optional[str] = Field(None, min_length=1, max_length=100)
-
-
-class UserProfileWithoutImageAndPhone(BaseModel):
-    login: str = Field(..., min_length=1, max_length=30, pattern="[a-zA-Z0-9-]+")
-    email: str = Field(..., min_length=1, max_length=50)
-    countryCode: str = Field(..., min_length=2, max_length=2, pattern="[a-zA-Z]{2}",
-                             description="Двухбуквенный код, уникально идентифицирующий страну")
-    isPublic: bool
-
-
 class UpdateProfile(BaseModel):
     countryCode: Optional[str] = Field(None, min_length=2, max_length=2, pattern="[a-zA-Z]{2}",
                                        description="Двухбуквенный код, уникально идентифицирующий страну")
@@ -84,10 +48,6 @@ class SingInUser(BaseModel):
     password: str = Field(..., min_length=6, max_length=100)
 
 
-class Profile(BaseModel):
-    profile: Union[UserProfile, UserProfileWithoutImage, UserProfileWithoutPhone, UserProfileWithoutImageAndPhone]
-
-
 class Friend(BaseModel):
     login: str = Field(..., min_length=1, max_length=30, pattern="[a-zA-Z0-9-]+")
     addedAt: str
@@ -0,0 +1,63 @@
+from hmac import compare_digest
+from time import time
+from typing import Optional
+from fastapi import Depends, Header
+from cache import TTLCache
+from const import DAY_TIME
+from crud import CRUD
+from db import get_session, bind_login, replica_engines
+from settings import get_settings
+
+settings = get_settings()
+tokens_cache = TTLCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+db = CRUD()
+
+
+class InvalidToken(Exception):
+    pass
+
+
+async def get_current_login(Authorization: Optional[str] = Header(default=None),
+                            session=Depends(get_session)) -> str:
+    if Authorization is None:
+        raise InvalidToken()
+
+    token = Authorization.split()
+
+    if len(token) != 2:
+        raise InvalidToken()
+
+    token = token[1]
+    cached = tokens_cache.get(token)
+
+    if cached is None:
+        token_data = (await db.get_token_by_token(session, token)).one_or_none()
+
+        if token_data is None:
+            raise InvalidToken()
+
+        cached = (token_data.login, token_data.creation_time)
+        tokens_cache.set(token, cached)
+
+    login, creation_time = cached
+
+    if time() - creation_time >= DAY_TIME:
+        tokens_cache.pop(token)
+        raise InvalidToken()
+
+    bind_login(session, login, await db.get_last_write(session, login) if replica_engines else None)
+    return login
+
+
+async def require_metrics_token(Authorization: Optional[str] = Header(default=None)) -> None:
+    if not settings.METRICS_TOKEN or Authorization is None or not compare_digest(
+            Authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()):
+        raise InvalidToken()
+
+
+def invalidate_tokens(login: str) -> None:
+    tokens_cache.discard_where(lambda token, cached: cached[0] == login)
+
+
+def invalidate_token(token: str) -> None:
+    tokens_cache.pop(token)
@@ -0,0 +1,19 @@
+from validators import format_time
+
+
+def dump_profile(user) -> dict:
+    profile = {"login": user.login, "email": user.email, "countryCode": user.countryCode, "isPublic": user.isPublic}
+    if user.phone is not None:
+        profile["phone"] = user.phone
+    if user.image is not None:
+        profile["image"] = user.image
+    return profile
+
+
+def dump_post(post, likesCount: int, dislikesCount: int) -> dict:
+    return {"id": post.id, "content": post.content, "author": post.author, "tags": post.tags,
+            "createdAt": format_time(post.createdAt), "likesCount": likesCount, "dislikesCount": dislikesCount}
+
+
+def dump_friend(friend) -> dict:
+    return {"login": friend.friend, "addedAt": format_time(friend.addedAt)}
@@ -8,6 +8,10 @@ load_dotenv()
 class Settings:
     SERVER_ADDRESS: str = getenv("SERVER_ADDRESS")
     SERVER_PORT: int = int(getenv("SERVER_PORT"))
+    SERVER_WORKERS: int = int(getenv("SERVER_WORKERS", 1))
+    SERVER_LOOP: str = getenv("SERVER_LOOP", "uvloop")
+    SERVER_HTTP: str = getenv("SERVER_HTTP", "httptools")
+    SERVER_ACCESS_LOG: bool = getenv("SERVER_ACCESS_LOG", "true").lower() in ("1", "true", "yes")
     POSTGRES_CONN: str = getenv("POSTGRES_CONN")
     POSTGRES_JDBC_URL: str = getenv("POSTGRES_JDBC_URL")
     POSTGRES_USERNAME: str = getenv("POSTGRES_USERNAME")
@@ -15,6 +19,41 @@ class Settings:
     POSTGRES_HOST: str = getenv("POSTGRES_HOST")
     POSTGRES_PORT: str = getenv("POSTGRES_PORT")
     POSTGRES_DATABASE: str = getenv("POSTGRES_DATABASE")
+    POSTGRES_REPLICA_HOSTS: list = [host for host in getenv("POSTGRES_REPLICA_HOSTS", "").split(",") if host]
+    READ_YOUR_WRITES_WINDOW: float = float(getenv("READ_YOUR_WRITES_WINDOW", 5))
+    POOL_SIZE: int = int(getenv("POOL_SIZE", 10))
+    POOL_MAX_OVERFLOW: int = int(getenv("POOL_MAX_OVERFLOW", 10))
+    POOL_TIMEOUT: float = float(getenv("POOL_TIMEOUT", 5))
+    POOL_PRE_PING: bool = getenv("POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    POOL_RECYCLE: int = int(getenv("POOL_RECYCLE", 1_800))
+    STATEMENT_TIMEOUT: int = int(getenv("STATEMENT_TIMEOUT", 10_000))
+    # /metrics and /api/stats/* answer only to "Authorization: Bearer <METRICS_TOKEN>" and are closed when it is unset
+    METRICS_TOKEN: str = getenv("METRICS_TOKEN", "")
+    DB_DEBUG_HEADERS: bool = getenv("DB_DEBUG_HEADERS", "false").lower() in ("1", "true", "yes")
+    DB_QUERY_BUDGET: int = int(getenv("DB_QUERY_BUDGET", 10))
+    TOKEN_CACHE_SIZE: int = int(getenv("TOKEN_CACHE_SIZE", 10_000))
+    # the caches below live in each worker process and are invalidated only in the worker that handled the write,
+    # so with several workers they default to off: a revoked token, a removed friend or a profile made private
+    # would otherwise stay visible through the other workers for up to the TTL
+    TOKEN_CACHE_TTL: float = float(getenv("TOKEN_CACHE_TTL", 60 if SERVER_WORKERS == 1 else 0))
+    TOKENS_PER_LOGIN: int = int(getenv("TOKENS_PER_LOGIN", 10))
+    TOKEN_SWEEP_INTERVAL: float = float(getenv("TOKEN_SWEEP_INTERVAL", 60))
+    TOKEN_SWEEP_BATCH: int = int(getenv("TOKEN_SWEEP_BATCH", 1_000))
+    PASSWORD_HASH_WORKERS: int = int(getenv("PASSWORD_HASH_WORKERS", 4))
+    SCRYPT_N: int = int(getenv("SCRYPT_N", 2 ** 14))
+    SCRYPT_R: int = int(getenv("SCRYPT_R", 8))
+    SCRYPT_P: int = int(getenv("SCRYPT_P", 1))
+    VISIBILITY_CACHE_SIZE: int = int(getenv("VISIBILITY_CACHE_SIZE", 100_000))
+    VISIBILITY_CACHE_TTL: float = float(getenv("VISIBILITY_CACHE_TTL", 30 if SERVER_WORKERS == 1 else 0))
+    PROFILE_CACHE_SIZE: int = int(getenv("PROFILE_CACHE_SIZE", 100_000))
+    PROFILE_CACHE_TTL: float = float(getenv("PROFILE_CACHE_TTL", 30 if SERVER_WORKERS == 1 else 0))
+    CATALOGUE_REFRESH_INTERVAL: float = float(getenv("CATALOGUE_REFRESH_INTERVAL", 300))
+    # write-behind deltas live in one process until the next flush and are lost if it crashes,
+    # so python main.py refuses it together with SERVER_WORKERS > 1
+    REACTION_WRITE_BEHIND: bool = getenv("REACTION_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+    REACTION_FLUSH_INTERVAL: float = float(getenv("REACTION_FLUSH_INTERVAL", 1))
+    TIMELINE_FANOUT_LIMIT: int = int(getenv("TIMELINE_FANOUT_LIMIT", 10_000))
+    TIMELINE_BACKFILL: int = int(getenv("TIMELINE_BACKFILL", 100))
 
 
 @lru_cache
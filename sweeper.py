@@ -0,0 +1,24 @@
+import asyncio
+import logging
+from time import time
+from const import DAY_TIME
+from crud import CRUD
+from db import session_maker
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+db = CRUD()
+
+
+async def sweep_tokens() -> None:
+    while True:
+        await asyncio.sleep(settings.TOKEN_SWEEP_INTERVAL)
+        try:
+            async with session_maker() as session:
+                before = time() - DAY_TIME
+                while await db.delete_expired_tokens(session, before, settings.TOKEN_SWEEP_BATCH) == \
+                        settings.TOKEN_SWEEP_BATCH:
+                    pass
+        except Exception:
+            logger.exception("Failed to sweep expired tokens")
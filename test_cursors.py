@@ -0,0 +1,78 @@
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta, timezone
+import orjson
+import pytest
+from cursors import (encode_cursor, decode_cursor, encode_time_cursor, decode_time_cursor, encode_rank_cursor,
+                     decode_rank_cursor)
+
+MOMENT = datetime(2024, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+
+def raw_cursor(payload: bytes) -> str:
+    return urlsafe_b64encode(payload).decode("ascii")
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("a", 1)) == ["a", 1]
+    assert decode_cursor(encode_cursor(0.5, "b", "c"), 3) == [0.5, "b", "c"]
+
+
+@pytest.mark.parametrize("key, key_type", [("9f0c1d", str), (42, int)])
+def test_time_cursor_round_trip(key, key_type):
+    assert decode_time_cursor(encode_time_cursor(MOMENT, key), key_type) == [MOMENT, key]
+
+
+def test_time_cursor_keeps_offset():
+    moment = MOMENT.astimezone(timezone(timedelta(hours=3)))
+    decoded, _ = decode_time_cursor(encode_time_cursor(moment, "x"), str)
+    assert decoded == MOMENT and decoded.utcoffset() == timedelta(hours=3)
+
+
+def test_rank_cursor_round_trip():
+    assert decode_rank_cursor(encode_rank_cursor(0.25, MOMENT, "x"), str) == [0.25, MOMENT, "x"]
+    assert decode_rank_cursor(encode_rank_cursor(1, MOMENT, "x"), str) == [1, MOMENT, "x"]
+
+
+@pytest.mark.parametrize("key, key_type", [("7", int), (7, str), (True, int), (False, str), (None, str),
+                                           (1.5, int), (["x"], str)])
+def test_time_cursor_rejects_wrong_key_type(key, key_type):
+    assert decode_time_cursor(encode_time_cursor(MOMENT, key), key_type) is None
+
+
+def test_post_cursor_is_rejected_by_friends():
+    assert decode_time_cursor(encode_time_cursor(MOMENT, "9f0c1d"), int) is None
+
+
+@pytest.mark.parametrize("key", [1, True, None])
+def test_rank_cursor_rejects_wrong_key_type(key):
+    assert decode_rank_cursor(encode_rank_cursor(0.25, MOMENT, key), str) is None
+
+
+@pytest.mark.parametrize("rank", [True, "0.5", None])
+def test_rank_cursor_rejects_bad_rank(rank):
+    assert decode_rank_cursor(encode_cursor(rank, MOMENT.isoformat(), "x"), str) is None
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", "eyJh", encode_time_cursor(MOMENT, "x")[:-3], "ключ"])
+def test_time_cursor_rejects_malformed_base64(cursor):
+    assert decode_time_cursor(cursor, str) is None
+
+
+@pytest.mark.parametrize("payload", [b"not json", b'{"a": 1}', b'"x"', b"[]"])
+def test_cursor_rejects_non_list_payload(payload):
+    assert decode_cursor(raw_cursor(payload)) is None
+
+
+@pytest.mark.parametrize("values", [[MOMENT.isoformat()], [MOMENT.isoformat(), "x", "y"]])
+def test_time_cursor_rejects_wrong_arity(values):
+    assert decode_time_cursor(raw_cursor(orjson.dumps(values)), str) is None
+
+
+@pytest.mark.parametrize("values", [[0.5, MOMENT.isoformat()], [0.5, MOMENT.isoformat(), "x", "y"]])
+def test_rank_cursor_rejects_wrong_arity(values):
+    assert decode_rank_cursor(raw_cursor(orjson.dumps(values)), str) is None
+
+
+@pytest.mark.parametrize("moment", ["yesterday", 1709296215, "2024-03-01T12:30:15"])
+def test_time_cursor_rejects_bad_or_naive_moment(moment):
+    assert decode_time_cursor(encode_cursor(moment, "x"), str) is None
@@ -1,7 +1,15 @@
 from re import fullmatch
-from hashlib import sha256
+from os import urandom
+from hmac import compare_digest
+from base64 import b64encode, b64decode
+from hashlib import sha256, scrypt
+from datetime import datetime, timezone
 from string import ascii_lowercase, ascii_uppercase
 from schemas import *
+from const import TIME_PATTERN
+from settings import get_settings
+
+settings = get_settings()
 
 
 def validate_login(login: str) -> bool:
@@ -68,18 +76,34 @@ def validate_offset(offset: int) -> bool:
     return True
 
 
+def validate_batch(keys: List[str]) -> bool:
+    if 0 < len(keys) <= 50:
+        return True
+    return False
+
+
 def validate_content(content: str) -> bool:
     if len(content) > 1_000 or len(content) == 0:
         return False
     return True
 
 
+def validate_query(query: str) -> bool:
+    if len(query) > 200 or len(query.strip()) == 0:
+        return False
+    return True
+
+
 def validate_tags(tags: List[str]) -> bool:
     if any(len(tag) > 20 or len(tag) == 0 for tag in tags):
         return False
     return True
 
 
+def normalize_tag(tag: str) -> str:
+    return tag.strip().casefold()
+
+
 def validate_data(user_data: User) -> bool:
     if not validate_login(user_data.login):
         return False
@@ -96,45 +120,6 @@ def validate_data(user_data: User) -> bool:
     return True
 
 
-def validate_profile(user_data: User) -> Profile:
-    if user_data.image is None and user_data.phone is None:
-        return Profile(profile=UserProfileWithoutImageAndPhone(login=user_data.login, email=user_data.email,
-                                                               countryCode=user_data.countryCode,
-                                                               isPublic=user_data.isPublic))
-    elif user_data.image is None:
-        return Profile(profile=UserProfileWithoutImage(login=user_data.login, email=user_data.email,
-                                                       countryCode=user_data.countryCode,
-                                                       isPublic=user_data.isPublic, phone=user_data.phone))
-    elif user_data.phone is None:
-        return Profile(profile=UserProfileWithoutPhone(login=user_data.login, email=user_data.email,
-                                                       countryCode=user_data.countryCode,
-                                                       isPublic=user_data.isPublic, image=user_data.image))
-
-    return Profile(profile=UserProfile(login=user_data.login, email=user_data.email, phone=user_data.phone,
-                                       countryCode=user_data.countryCode, isPublic=user_data.isPublic,
-                                       image=user_data.image))
-
-
-def validate_user(user_data: User) -> Union[
-    UserProfile, UserProfileWithoutImage, UserProfileWithoutPhone, UserProfileWithoutImageAndPhone]:
-    if user_data.image is None and user_data.phone is None:
-        return UserProfileWithoutImageAndPhone(login=user_data.login, email=user_data.email,
-                                               countryCode=user_data.countryCode,
-                                               isPublic=user_data.isPublic)
-    elif user_data.image is None:
-        return UserProfileWithoutImage(login=user_data.login, email=user_data.email,
-                                       countryCode=user_data.countryCode,
-                                       isPublic=user_data.isPublic, phone=user_data.phone)
-    elif user_data.phone is None:
-        return UserProfileWithoutPhone(login=user_data.login, email=user_data.email,
-                                       countryCode=user_data.countryCode,
-                                       isPublic=user_data.isPublic, image=user_data.image)
-
-    return UserProfile(login=user_data.login, email=user_data.email, phone=user_data.phone,
-                       countryCode=user_data.countryCode, isPublic=user_data.isPublic,
-                       image=user_data.image)
-
-
 def validate_update_profile(user_data: UpdateProfile) -> bool:
     if user_data.countryCode is not None and not validate_countryCode(user_data.countryCode):
         return False
@@ -145,5 +130,40 @@ def validate_update_profile(user_data: UpdateProfile) -> bool:
     return True
 
 
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, dklen: int = 32) -> bytes:
+    return scrypt(bytes(password, encoding="utf-8"), salt=salt, n=n, r=r, p=p,
+                  maxmem=128 * r * (n + p + 2) + 1024, dklen=dklen)
+
+
+def _b64encode(data: bytes) -> str:
+    return b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return b64decode(data + "=" * (-len(data) % 4))
+
+
 def get_hash(password: str) -> str:
-    return sha256(bytes(password, encoding="utf-8")).hexdigest()
+    n, r, p = settings.SCRYPT_N, settings.SCRYPT_R, settings.SCRYPT_P
+    salt = urandom(16)
+    return f"scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(_scrypt(password, salt, n, r, p))}"
+
+
+def check_hash(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith("scrypt$"):
+        return compare_digest(sha256(bytes(password, encoding="utf-8")).hexdigest(), password_hash)
+
+    try:
+        _, n, r, p, salt, digest = password_hash.split("$")
+        digest = _b64decode(digest)
+        return compare_digest(_scrypt(password, _b64decode(salt), int(n), int(r), int(p), len(digest)), digest)
+    except ValueError:
+        return False
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith(f"scrypt${settings.SCRYPT_N}${settings.SCRYPT_R}${settings.SCRYPT_P}$")
+
+
+def format_time(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime(TIME_PATTERN) + "07:00"
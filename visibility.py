@@ -0,0 +1,50 @@
+from typing import Optional, Iterable, Set
+from cache import TTLCache
+from crud import CRUD
+from settings import get_settings
+
+settings = get_settings()
+visibility_cache = TTLCache(settings.VISIBILITY_CACHE_SIZE, settings.VISIBILITY_CACHE_TTL)
+db = CRUD()
+
+
+async def can_see(session, viewer: str, author: str, isPublic: Optional[bool] = None) -> bool:
+    if viewer == author:
+        return True
+
+    key = (author, viewer)
+    allowed = visibility_cache.get(key)
+
+    if allowed is None:
+        if isPublic is None:
+            isPublic = (await db.get_user_by_login(session, author)).one().isPublic
+        allowed = isPublic or await db.is_friend(session, author, viewer)
+        visibility_cache.set(key, allowed)
+
+    return allowed
+
+
+async def visible_authors(session, viewer: str, authors: Iterable[str]) -> Set[str]:
+    allowed, missing = set(), []
+    for author in set(authors):
+        cached = True if author == viewer else visibility_cache.get((author, viewer))
+        if cached is None:
+            missing.append(author)
+        elif cached:
+            allowed.add(author)
+
+    if missing:
+        found = set((await db.get_visible_authors(session, viewer, missing)).all())
+        for author in missing:
+            visibility_cache.set((author, viewer), author in found)
+        allowed |= found
+
+    return allowed
+
+
+def invalidate_friendship(author: str, viewer: str) -> None:
+    visibility_cache.pop((author, viewer))
+
+
+def invalidate_author(author: str) -> None:
+    visibility_cache.discard_where(lambda key, allowed: key[0] == author)